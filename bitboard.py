@@ -0,0 +1,145 @@
+"""
+bitboard
+~~~~~~~~
+
+Sets of grid cells stored as the bits of python integers.
+
+:copyright: (c) 2013 by Matthias Hummel and Kristoffer Kleine.
+:license: BSD, see LICENSE for more details.
+"""
+
+from array import array
+
+
+class Bitboard(object):
+    """
+    Set operations on the cells of a grid with the given number of rows and
+    columns. A set of cells is a python integer (mask) in which the cell at
+    y * columns + x is the bit with that index, so whole sets are combined or
+    moved with a few big integer operations.
+    """
+
+    def __init__(self, rows, columns):
+
+        self.rows = rows
+        self.columns = columns
+        self.size = rows * columns
+
+        self.full = (1 << self.size) - 1
+
+        first_column = 0
+        for y in xrange(rows):
+            first_column |= 1 << (y * columns)
+
+        # cells which can be moved west or east without leaving their row
+        self.not_first_column = self.full & ~first_column
+        self.not_last_column = self.full & ~(first_column << (columns - 1))
+
+    def from_cells(self, cells, states):
+        """
+        Return the mask of the cells whose state is one of states. cells is
+        a byte string with the state of every cell.
+        """
+
+        table = ''.join('1' if chr(c) in states else '0' for c in xrange(256))
+        bits = str(cells).translate(table)
+        if not bits:
+            return 0
+        return int(bits[::-1], 2)
+
+    def indices(self, mask):
+        """
+        Return the indices of the cells in mask in ascending order
+        """
+
+        if not mask:
+            return []
+
+        # only look at the bits from the lowest cell in mask upwards
+        low = (mask & -mask).bit_length() - 1
+        bits = bin(mask >> low)[:1:-1]
+
+        indices = []
+        i = bits.find('1')
+        while i != -1:
+            indices.append(low + i)
+            i = bits.find('1', i + 1)
+        return indices
+
+    def north(self, mask):
+        """
+        Return mask moved one row up
+        """
+
+        return mask >> self.columns
+
+    def south(self, mask):
+        """
+        Return mask moved one row down
+        """
+
+        return (mask << self.columns) & self.full
+
+    def west(self, mask):
+        """
+        Return mask moved one column to the left
+        """
+
+        return (mask & self.not_first_column) >> 1
+
+    def east(self, mask):
+        """
+        Return mask moved one column to the right
+        """
+
+        return (mask & self.not_last_column) << 1
+
+    def dilate(self, mask):
+        """
+        Return the mask of all cells which have a neighbor in mask
+        """
+
+        return (self.north(mask) | self.south(mask) |
+                self.west(mask) | self.east(mask))
+
+    def missing_neighbor(self, present):
+        """
+        Return the mask of the cells in present which have a neighbor that
+        is not in present, including the cells at the border of the grid
+        """
+
+        complete = (self.north(present) & self.south(present) &
+                    self.west(present) & self.east(present))
+        return present & ~complete
+
+    def distance_field(self, present, zero, one=0):
+        """
+        Breadth first search over the cells in present, one whole level at a
+        time. Cells in zero get distance 0, cells in one distance 1 and all
+        other cells their distance to these. Returns a flat array with the
+        distance of every cell, -1 for unreachable cells.
+        """
+
+        field = array('i', [-1]) * self.size
+
+        frontier = zero & present
+        for i in self.indices(frontier):
+            field[i] = 0
+
+        reached = frontier
+        grown = one & present & ~reached
+        level = 1
+        while True:
+            grown = (grown | (self.dilate(frontier) & present)) & ~reached
+            if not grown:
+                break
+
+            for i in self.indices(grown):
+                field[i] = level
+
+            reached |= grown
+            frontier = grown
+            grown = 0
+            level += 1
+
+        return field
@@ -0,0 +1,172 @@
+"""
+floodcards
+~~~~~~~~~~
+
+Keeps track of the flood cards to estimate which fields flood next.
+
+:copyright: (c) 2013 by Matthias Hummel and Kristoffer Kleine.
+:license: BSD, see LICENSE for more details.
+"""
+
+from itertools import combinations
+
+from graph import State
+
+
+class _Pile(object):
+    """
+    Cards whose order is unknown, together with the probability that one of
+    them is drawn in the next round
+    """
+
+    __slots__ = ('cards', 'probability')
+
+    def __init__(self, cards=()):
+        self.cards = set(cards)
+        self.probability = 0.0
+
+
+class FloodCards(object):
+    """
+    Tracks the deck of flood cards. There is one card per field which has
+    not drowned yet. Every round level cards are drawn from the top of the
+    deck and the fields on them flood. Drawn cards go to the discard pile,
+    unless their field drowned. When the flood level rises the discard pile
+    is shuffled and put on top of the deck, when the deck runs out the
+    discard pile is shuffled and becomes the deck.
+
+    The deck is kept as a list of piles from top to bottom, the order of the
+    cards within each pile is unknown.
+    """
+
+    def __init__(self, board, level=0):
+
+        self.columns = board.columns
+        self.level = level
+
+        cards = [y * board.columns + x
+                 for y in xrange(board.rows) for x in xrange(board.columns)
+                 if board.get_state(x, y) != State.drowned]
+
+        self._deck = [_Pile(cards)]
+        self._discarded = _Pile()
+
+        # the pile every card is in
+        self._pile_of = dict((card, self._deck[0]) for card in cards)
+
+        self._probabilities_valid = False
+
+    def increase_level(self, n):
+        """
+        Apply an INCRFLOOD n message
+        """
+
+        self.level += n
+
+        if n > 0 and self._discarded.cards:
+            self._deck.insert(0, self._discarded)
+            self._discarded = _Pile()
+
+        self._probabilities_valid = False
+
+    def card_drawn(self, x, y, drowned):
+        """
+        Apply a FLOOD x, y message. drowned tells whether the field drowned
+        and its card left the game.
+        """
+
+        if not any(pile.cards for pile in self._deck):
+            self._deck = [self._discarded]
+            self._discarded = _Pile()
+
+        card = y * self.columns + x
+        pile = self._pile_of.pop(card, None)
+        if pile is not None:
+            pile.cards.discard(card)
+
+        if not drowned:
+            self._discarded.cards.add(card)
+            self._pile_of[card] = self._discarded
+
+        self._probabilities_valid = False
+
+    def _calculate_probabilities(self):
+
+        self._deck = [pile for pile in self._deck if pile.cards]
+
+        remaining = self.level
+        for pile in self._deck:
+            drawn = min(remaining, len(pile.cards))
+            pile.probability = float(drawn) / len(pile.cards)
+            remaining -= drawn
+
+        # the discard pile becomes the deck if it runs out during the round
+        discarded = len(self._discarded.cards)
+        if remaining and discarded:
+            self._discarded.probability = min(1.0, float(remaining) / discarded)
+        else:
+            self._discarded.probability = 0.0
+
+        self._probabilities_valid = True
+
+    def probability(self, x, y):
+        """
+        Return the probability that the field at x, y floods next round
+        """
+
+        if not self._probabilities_valid:
+            self._calculate_probabilities()
+
+        pile = self._pile_of.get(y * self.columns + x)
+        if pile is None:
+            return 0.0
+        return pile.probability
+
+    def certain_floods(self):
+        """
+        Return the (x, y) positions of the fields which flood next round if
+        the cards drawn are already known, otherwise None. This is the case
+        when the cards to draw make up whole piles at the top of the deck.
+        """
+
+        floods = self.likely_floods()
+        fields = next(floods)
+        if next(floods, None) is not None:
+            return None
+
+        return fields
+
+    def likely_floods(self):
+        """
+        Yield the (x, y) positions of the fields which may flood next round,
+        one possible set at a time, the likeliest first. The cards of the
+        piles drawn completely are certain, the cards still to draw come from
+        the next pile, where every choice of them is just as likely.
+        """
+
+        if not self._probabilities_valid:
+            self._calculate_probabilities()
+
+        certain = []
+        remaining = self.level
+        for pile in self._deck + [self._discarded]:
+            if not remaining:
+                break
+
+            if pile.probability == 1.0:
+                certain.extend(pile.cards)
+                remaining -= len(pile.cards)
+            elif pile.probability > 0.0:
+                for drawn in combinations(sorted(pile.cards), remaining):
+                    yield self._positions(certain + list(drawn))
+                return
+
+        yield self._positions(certain)
+
+    def _positions(self, cards):
+
+        positions = []
+        for card in cards:
+            y, x = divmod(card, self.columns)
+            positions.append((x, y))
+        return positions
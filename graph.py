@@ -6,7 +6,36 @@ graph
 :license: BSD, see LICENSE for more details.
 """
 
-from collections import defaultdict
+import random
+from array import array
+from collections import defaultdict, deque, OrderedDict
+from heapq import heapify, heappop, heappush
+
+from bitboard import Bitboard
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# graphs with fewer nodes are faster to handle with the plain python search
+NUMPY_MIN_NODES = 1000
+
+# graphs with fewer nodes are faster to handle node by node than as bitboards
+BITBOARD_MIN_NODES = 100
+
+DISTANCE_LAYERS = ('water', 'flooded', 'land')
+
+# maximum number of nodes in all shortest path trees cached by one graph
+PATH_CACHE_SIZE = 200000
+
+# maximum number of entries of a TranspositionTable
+TRANSPOSITION_TABLE_SIZE = 10000
+
+# the moves of the directions of the commands
+DIRECTIONS = {'NORTH': (0, -1), 'EAST': (1, 0), 'SOUTH': (0, 1),
+              'WEST': (-1, 0), 'CURRENT': (0, 0)}
 
 
 class State(object):
@@ -16,39 +45,118 @@ class State(object):
     redry = '~'
 
 
+def flooded_state(state):
+    """
+    Return the state a field with the given state has after it is flooded
+    """
+
+    if state in (State.dry, State.redry):
+        return State.flooded
+    elif state == State.flooded:
+        return State.drowned
+    return state
+
+
 class Field(object):
+    """
+    View on a single cell of a Board
+    """
 
-    def __init__(self, x=0, y=0, state=State.dry):
+    __slots__ = ('_board', 'x', 'y')
+
+    def __init__(self, board, x=0, y=0):
+        self._board = board
         self.x = x
         self.y = y
-        self.state = state
 
+    @property
+    def state(self):
+        return self._board.get_state(self.x, self.y)
+
+    @state.setter
+    def state(self, state):
+        self._board.set_state(self.x, self.y, state)
+
+
+class Row(object):
+    """
+    View on a single row of a Board
+    """
+
+    __slots__ = ('_board', 'y')
+
+    def __init__(self, board, y):
+        self._board = board
+        self.y = y
+
+    def __len__(self):
+        return self._board.columns
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self._board.columns
+        if not 0 <= x < self._board.columns:
+            raise IndexError('column index out of range')
+        return Field(self._board, x, self.y)
 
-class Board(list):
+    def __iter__(self):
+        for x in xrange(self._board.columns):
+            yield Field(self._board, x, self.y)
 
-    def __init__(self, board):
-        list.__init__(self, board)
+
+class Board(object):
+    """
+    The game board stored as a flat bytearray of states in row-major order.
+    Indexing with board[y][x] returns Field views on the underlying cells.
+    """
+
+    def __init__(self, rows, columns, cells=None):
+
+        self.rows = rows
+        self.columns = columns
+
+        if cells is None:
+            self._cells = bytearray(State.dry * (rows * columns))
+        else:
+            self._cells = bytearray(cells)
+
+        if len(self._cells) != rows * columns:
+            raise ValueError('board must have rows * columns cells')
 
     @staticmethod
     def from_string(s):
-        board = []
-        for y, line in enumerate(s.strip().split()):
-            board.append([])
-            for x, state in enumerate(line):
-                board[-1].append(Field(x, y, state))
-        return Board(board)
+        lines = s.strip().split()
+        return Board(len(lines), len(lines[0]), ''.join(lines))
+
+    def get_state(self, x, y):
+        return chr(self._cells[y * self.columns + x])
+
+    def set_state(self, x, y, state):
+        self._cells[y * self.columns + x] = ord(state)
 
     def flood(self, x, y):
 
-        field = self[y][x]
-        if field.state in (State.dry, State.redry):
-            field.state = State.flooded
-        elif field.state == State.flooded:
-            field.state = State.drowned
+        i = y * self.columns + x
+        self._cells[i] = ord(flooded_state(chr(self._cells[i])))
 
     def dry(self, x, y):
 
-        self[y][x].state = State.redry
+        self._cells[y * self.columns + x] = ord(State.redry)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.rows
+        if not 0 <= y < self.rows:
+            raise IndexError('row index out of range')
+        return Row(self, y)
+
+    def __iter__(self):
+        for y in xrange(self.rows):
+            yield Row(self, y)
+
 
 
 class Node(object):
@@ -58,8 +166,14 @@ class Node(object):
         self.x = x
         self.y = y
 
+        # index of the node in its graph, see Graph.index
+        self.id = -1
+
         self._state = state
 
+        # the graph which gets notified about state changes
+        self.graph = None
+
         self.distance_to_water = -1
         self.distance_to_flooded = -1
         self.distance_to_land = -1
@@ -79,7 +193,11 @@ class Node(object):
 
     @staticmethod
     def from_node(node):
-        return Node(node.x, node.y, node.state)
+        copy = Node(node.x, node.y, node.state)
+        copy.distance_to_water = node.distance_to_water
+        copy.distance_to_flooded = node.distance_to_flooded
+        copy.distance_to_land = node.distance_to_land
+        return copy
 
 
     @property
@@ -110,9 +228,20 @@ class Node(object):
 
     @state.setter
     def state(self, state):
+        if state == self._state:
+            return
+
+        old_state = self._state
         self._state = state
         self.should_recalculate_node_properties = True
 
+        # the properties of the neighbors depend on our state too
+        for neighbor in self.neighbors:
+            neighbor.should_recalculate_node_properties = True
+
+        if self.graph is not None:
+            self.graph.node_state_changed(self, old_state)
+
     @property
     def neighbors(self):
         if self.should_update_neighbors:
@@ -209,6 +338,9 @@ class Node(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return (self.y << 16) ^ self.x
+
     def __repr__(self):
         return 'Node({}, {})'.format(self.x, self.y)
 
@@ -226,28 +358,333 @@ class Node(object):
         return value
 
 
+def _shift(grid, dx, dy):
+    """
+    Return grid moved by dx, dy. Cells moved in from outside are zero.
+    """
+
+    rows, columns = grid.shape
+    shifted = numpy.zeros_like(grid)
+    shifted[max(dy, 0):rows + min(dy, 0), max(dx, 0):columns + min(dx, 0)] = \
+        grid[max(-dy, 0):rows + min(-dy, 0), max(-dx, 0):columns + min(-dx, 0)]
+    return shifted
+
+
+def _dilate(grid):
+    """
+    Return a mask of all cells which have a neighbor in grid
+    """
+
+    return (_shift(grid, 1, 0) | _shift(grid, -1, 0) |
+            _shift(grid, 0, 1) | _shift(grid, 0, -1))
+
+
+def _numpy_distance_field(present, zero, one):
+    """
+    Vectorized multi source breadth first search over the present cells.
+    Cells in zero get distance 0, cells in one distance 1 and all other cells
+    their distance to these. Unreachable cells get -1.
+    """
+
+    distance = numpy.full(present.shape, -1, dtype=numpy.int32)
+    distance[zero] = 0
+
+    frontier = zero
+    grown = one & ~zero
+    level = 1
+    while True:
+        grown = (grown | (_dilate(frontier) & present)) & (distance == -1)
+        if not grown.any():
+            break
+        distance[grown] = level
+        frontier = grown
+        grown = numpy.zeros_like(present)
+        level += 1
+
+    return distance
+
+
+def _distance_seed(layer, node):
+    """
+    Return the distance node has in layer on its own, without looking at
+    the distances of its neighbors. None if it has to be searched for.
+    """
+
+    if layer == 'water':
+        if node.is_water:
+            return 0
+        elif node.is_next_to_water:
+            return 1
+    elif layer == 'flooded':
+        if (node.state == State.flooded or
+            any(n.state == State.flooded for n in node.neighbors)):
+            return 0
+    elif node.is_dry:
+        return 0
+    elif node.is_next_to_land:
+        return 1
+
+    return None
+
+
+class PathTree(object):
+    """
+    Shortest paths from root to the nodes it contains. The tables are keyed
+    by node id: predecessors maps every node to the node before it on a
+    shortest path from root, distances to its distance from root. If the
+    tree is complete it contains every node which is reachable from root.
+    """
+
+    def __init__(self, root, predecessors, distances, complete):
+
+        self.root = root
+        self.predecessors = predecessors
+        self.distances = distances
+        self.complete = complete
+
+        self.radius = max(distances.itervalues())
+
+    def __len__(self):
+        return len(self.distances)
+
+    def knows(self, node):
+        """
+        Return whether the tree knows the distance between root and node
+        """
+
+        return node.id in self.distances or self.complete
+
+    def next_node_from_root(self, target):
+        """
+        Return the first node after root on the path to target
+        """
+
+        if target.id not in self.distances:
+            return None
+
+        predecessors = self.predecessors
+        root_id = self.root.id
+
+        node = target
+        while True:
+            predecessor = predecessors[node.id]
+            if predecessor is None or predecessor.id == root_id:
+                return node
+            node = predecessor
+
+    def node_added(self, node):
+        """
+        Update the tree after node joined the graph. Return False if the
+        tree can not be kept because paths through node may be shorter.
+        """
+
+        distances = self.distances
+        if node.id in distances:
+            return True
+
+        neighbors = node.neighbors
+        known = [n for n in neighbors if n.id in distances]
+
+        if known:
+            nearest = min(known, key=lambda n: distances[n.id])
+            distance = distances[nearest.id]
+            farthest = max(distances[n.id] for n in known)
+
+            # if all known neighbors are at most two steps apart a detour
+            # over node is never shorter, so node is a leaf of the tree
+            if farthest - distance <= 2:
+                if self.complete or len(known) == len(neighbors):
+                    if len(known) < len(neighbors):
+                        # nodes behind node are not part of the tree yet
+                        self.complete = False
+                    self.predecessors[node.id] = nearest
+                    distances[node.id] = distance + 1
+                    self.radius = max(self.radius, distance + 1)
+                    return True
+        elif self.complete:
+            # node is not reachable from root
+            return True
+
+        # any path over node is at least as long as the manhattan distance
+        distance = abs(node.x - self.root.x) + abs(node.y - self.root.y)
+        return distance >= self.radius
+
+    def node_removed(self, node):
+        """
+        Update the tree after node left the graph. Return False if the tree
+        can not be kept because shortest paths went through node.
+        """
+
+        if node.id not in self.distances:
+            return True
+        if node.id == self.root.id:
+            return False
+
+        for neighbor in node.neighbors:
+            predecessor = self.predecessors.get(neighbor.id)
+            if predecessor is not None and predecessor.id == node.id:
+                return False
+
+        del self.predecessors[node.id]
+        del self.distances[node.id]
+        return True
+
+
+class PathCache(object):
+    """
+    Cache of shortest path trees, at most one per root node. The trees hold
+    at most max_size nodes all together, when there are more the least
+    recently used trees are evicted.
+    """
+
+    def __init__(self, max_size=None):
+
+        self.max_size = PATH_CACHE_SIZE if max_size is None else max_size
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._trees = OrderedDict()
+
+    def __len__(self):
+        return len(self._trees)
+
+    def add(self, tree):
+
+        old = self._trees.pop(tree.root.id, None)
+        if old is not None:
+            self.size -= len(old)
+
+        self._trees[tree.root.id] = tree
+        self.size += len(tree)
+
+        while self.size > self.max_size and len(self._trees) > 1:
+            _, evicted = self._trees.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def find(self, start, target):
+        """
+        Return a cached tree rooted at target or start which knows the
+        distance between the two, None if there is none
+        """
+
+        for root, other in ((target, start), (start, target)):
+            tree = self._trees.get(root.id)
+            if tree is not None and tree.knows(other):
+                # mark as most recently used
+                del self._trees[root.id]
+                self._trees[root.id] = tree
+
+                self.hits += 1
+                return tree
+
+        self.misses += 1
+        return None
+
+    def node_added(self, node):
+        """
+        Drop the trees in which node may shorten paths
+        """
+
+        for root, tree in self._trees.items():
+            size = len(tree)
+            if tree.node_added(node):
+                self.size += len(tree) - size
+            else:
+                del self._trees[root]
+                self.size -= size
+
+    def node_removed(self, node):
+        """
+        Drop the trees with paths through node
+        """
+
+        for root, tree in self._trees.items():
+            size = len(tree)
+            if tree.node_removed(node):
+                self.size += len(tree) - size
+            else:
+                del self._trees[root]
+                self.size -= size
+
+    def clear(self):
+
+        self._trees.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'trees': len(self._trees),
+                'size': self.size}
+
+
 class Graph(object):
+    """
+    A grid of nodes. The grid may be a window of the board, in which case
+    x0 and y0 are the board coordinates of its upper left corner. Nodes
+    always keep their board coordinates.
+    """
 
-    def __init__(self, nodes):
+    def __init__(self, nodes, x0=0, y0=0):
 
         self._nodes = nodes
         self.rows = len(nodes)
         self.columns = len(nodes[0])
 
-        self._cached_paths = defaultdict(lambda: defaultdict(dict))
-        self._cached_distances = defaultdict(lambda: defaultdict(int))
+        self.x0 = x0
+        self.y0 = y0
+
+        # index(x, y) == y * columns + x - offset
+        self.offset = y0 * self.columns + x0
+
+        self._init_caches()
 
         self._connect_nodes()
 
         self._update_non_null_nodes()
 
+    def _init_caches(self):
+
+        self.path_cache = PathCache()
+        self._views = {}
+
+        self.distance_fields = {}
+        self._tracked_layers = ()
+
+        self.connectivity = None
+
+        self._bitboard = None
+
+        self._middle = None
+        self._middle_version = -1
+
+        # scratch tables of _search_path_tree
+        self._search_tables = None
+        self._search_generation = 0
+
+        self._component_labels = None
+        self._component_labels_version = -1
+
+        # incremented whenever the state of a node changes
+        self.version = 0
+
+        self.zobrist = None
+
+        # the position of the bot as far as apply and undo are concerned,
+        # every applied action leaves (old position, [(node, old state)])
+        self._position = None
+        self._undo_log = []
+
     @staticmethod
     def from_board(board):
         nodes = []
-        for line in board:
+        for y in xrange(board.rows):
             nodes.append([])
-            for field in line:
-                node = Node(field.x, field.y, field.state)
+            for x in xrange(board.columns):
+                node = Node(x, y, board.get_state(x, y))
                 nodes[-1].append(node)
         return Graph(nodes)
 
@@ -255,15 +692,91 @@ class Graph(object):
     @staticmethod
     def from_graph(graph):
         nodes = []
-        for row in graph._nodes:
+        for y in xrange(graph.y0, graph.y0 + graph.rows):
             nodes.append([])
-            for field in row:
+            for x in xrange(graph.x0, graph.x0 + graph.columns):
+                field = graph.get_node(x, y)
                 if field is None:
                     nodes[-1].append(None)
                 else:
                     node = Node(field.x, field.y, field.state)
                     nodes[-1].append(node)
-        return Graph(nodes)
+        return Graph(nodes, graph.x0, graph.y0)
+
+
+    def flood(self, x, y):
+        """
+        Apply a FLOOD event to the node at x, y
+        """
+
+        node = self.get_node(x, y)
+        if node is not None:
+            node.state = flooded_state(node.state)
+
+    def dry(self, x, y):
+        """
+        Apply a DRY event to the node at x, y
+        """
+
+        node = self.get_node(x, y)
+        if node is not None:
+            node.state = State.redry
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, position):
+        if self.zobrist is not None:
+            self.zobrist.position_changed(self._position, position)
+        self._position = position
+
+    def apply(self, action):
+        """
+        Apply action, a (command, x, y) tuple like the strategies create.
+        The command starts with GO, DRY or FLOOD. Everything it changes is
+        logged, so undo can revert it. If the coordinates are None they are
+        taken from the direction in the command, relative to position.
+        """
+
+        words = action[0].split()
+        command, x, y = words[0], action[1], action[2]
+
+        if command not in ('GO', 'DRY', 'FLOOD'):
+            raise ValueError('unknown command: {}'.format(command))
+
+        if x is None or y is None:
+            if self.position is None or len(words) < 2 or words[1] not in DIRECTIONS:
+                raise ValueError('no coordinates for {}'.format(action[0]))
+            dx, dy = DIRECTIONS[words[1]]
+            x, y = self.position[0] + dx, self.position[1] + dy
+
+        changes = []
+        self._undo_log.append((self.position, changes))
+
+        if command == 'GO':
+            self.position = (x, y)
+            return
+
+        node = self.get_node(x, y)
+        if node is not None:
+            changes.append((node, node.state))
+
+        if command == 'DRY':
+            self.dry(x, y)
+        else:
+            self.flood(x, y)
+
+    def undo(self):
+        """
+        Revert the last applied action. Derived data like distances and
+        components follows the restored states as usual.
+        """
+
+        self.position, changes = self._undo_log.pop()
+        for node, state in reversed(changes):
+            node.state = state
 
 
     def _connect_nodes(self):
@@ -283,10 +796,14 @@ class Graph(object):
     def _update_non_null_nodes(self):
 
         self.nodes = []
+        self.state_counts = defaultdict(int)
         for row in self._nodes:
             for node in row:
                 if node is not None:
+                    node.graph = self
+                    node.id = self.index(node.x, node.y)
                     self.nodes.append(node)
+                    self.state_counts[node.state] += 1
 
 
     def __contains__(self, other):
@@ -300,16 +817,31 @@ class Graph(object):
         return True
 
 
+    def index(self, x, y):
+        """
+        Return the index of the cell x, y in flat per cell arrays
+        """
+
+        return y * self.columns + x - self.offset
+
     def get_node(self, x, y):
-        return self._nodes[y][x]
+
+        x -= self.x0
+        y -= self.y0
+        if 0 <= x < self.columns and 0 <= y < self.rows:
+            return self._nodes[y][x]
+        return None
 
     def add_node(self, node):
 
-        self._nodes[node.y][node.x] = node
+        x, y = node.x - self.x0, node.y - self.y0
 
-        self.nodes.append(node)
+        self._nodes[y][x] = node
 
-        x, y = node.x, node.y
+        node.graph = self
+        node.id = self.index(node.x, node.y)
+        self.nodes.append(node)
+        self.state_counts[node.state] += 1
 
         if x > 0:
             node.west = self._nodes[y][x-1]
@@ -328,14 +860,20 @@ class Graph(object):
             if node.south is not None:
                 node.south.north = node
 
+        self.path_cache.node_added(node)
+
+        if self._tracked_layers:
+            self.track_distances(self._tracked_layers)
+        if self.connectivity is not None:
+            self.track_connectivity()
 
 
     def remove_node(self, node):
 
-        if self._nodes[node.y][node.x] is None:
+        if self.get_node(node.x, node.y) is None:
             return
 
-        self._nodes[node.y][node.x] = None
+        self._nodes[node.y - self.y0][node.x - self.x0] = None
 
         # set connections referring to this node to None
         if node.east is not None:
@@ -349,221 +887,587 @@ class Graph(object):
 
 
         self.nodes.remove(node)
+        self.state_counts[node.state] -= 1
+        if node.graph is self:
+            node.graph = None
 
-        self._cached_distances.clear()
-        self._cached_paths.clear()
+        self.path_cache.node_removed(node)
 
+        if self._tracked_layers:
+            self.track_distances(self._tracked_layers)
+        if self.connectivity is not None:
+            self.track_connectivity()
 
-    def calculate_distance_to_water(self):
+
+    def view(self, states):
         """
-        Marks all node with their respective distance to water
+        Return the view of the graph which only contains the nodes whose
+        state is one of states. Views are kept, so they and their caches
+        live as long as the graph.
         """
 
-        curset = set()
+        states = frozenset(states)
 
-        for node in self.nodes:
-            if node.is_next_to_water:
-                node.distance_to_water = 1
-                curset.add(node)
-            elif node.is_water:
-                node.distance_to_water = 0
-
-        distance = 2
-        while curset:
-            newset = set()
-            for node in curset:
-                for neighbor in node.neighbors:
-                    if neighbor.distance_to_water == -1:
-                        neighbor.distance_to_water = distance
-                        newset.add(neighbor)
-            curset = newset
-            distance += 1
+        view = self._views.get(states)
+        if view is None:
+            view = self._views[states] = GraphView(self, states)
 
+        return view
 
-    def calculate_distance_to_flooded(self):
+
+    def _state_cells(self):
         """
-        Marks all node with their respective distance to a flooded node
+        Return a bytearray with the state of every cell, indexed by
+        index(x, y). Cells which are not in the graph are 0.
         """
 
-        curset = set()
-
+        cells = bytearray(self.rows * self.columns)
         for node in self.nodes:
-            if node.state == State.flooded:
-                node.distance_to_flooded = 0
-                curset.add(node)
-            elif any(n.state == State.flooded for n in node.neighbors):
-                node.distance_to_flooded = 0
-                curset.add(node)
+            cells[node.id] = ord(node.state)
+        return cells
+
+    def _use_numpy(self):
+        return numpy is not None and len(self.nodes) >= NUMPY_MIN_NODES
+
+    def _use_bitboard(self):
+        return len(self.nodes) >= BITBOARD_MIN_NODES
+
+    def _get_bitboard(self):
+        if self._bitboard is None:
+            self._bitboard = Bitboard(self.rows, self.columns)
+        return self._bitboard
+
+    def _compute_distance_layers_with_numpy(self, layers):
+
+        states = numpy.frombuffer(self._state_cells(), dtype=numpy.uint8)
+        states = states.reshape((self.rows, self.columns))
+
+        present = states != 0
+        flooded = states == ord(State.flooded)
+        water = flooded | (states == ord(State.drowned))
+        dry = present & ~water
+
+        fields = {}
+        for layer in layers:
+            if layer == 'water':
+                # nodes at the border of the graph are next to water too
+                missing = ~(_shift(present, 1, 0) & _shift(present, -1, 0) &
+                            _shift(present, 0, 1) & _shift(present, 0, -1))
+                zero = water
+                one = dry & (_dilate(water) | missing)
+            elif layer == 'flooded':
+                zero = present & (flooded | _dilate(flooded))
+                one = numpy.zeros_like(present)
+            else:
+                zero = dry
+                one = water & _dilate(dry)
+
+            fields[layer] = _numpy_distance_field(present, zero, one).ravel()
+
+        return fields
+
+    def _compute_distance_layers_with_bitboard(self, layers):
+
+        bitboard = self._get_bitboard()
+        cells = self._state_cells()
+
+        present = bitboard.from_cells(cells, (State.dry, State.redry,
+                                              State.flooded, State.drowned))
+        flooded = bitboard.from_cells(cells, (State.flooded,))
+        water = flooded | bitboard.from_cells(cells, (State.drowned,))
+        dry = present & ~water
+
+        fields = {}
+        for layer in layers:
+            if layer == 'water':
+                # nodes at the border of the graph are next to water too
+                zero = water
+                one = dry & (bitboard.dilate(water) |
+                             bitboard.missing_neighbor(present))
+            elif layer == 'flooded':
+                zero = present & (flooded | bitboard.dilate(flooded))
+                one = 0
+            else:
+                zero = dry
+                one = water & bitboard.dilate(dry)
 
-        distance = 1
-        while curset:
-            newset = set()
-            for node in curset:
-                for neighbor in node.neighbors:
-                    if neighbor.distance_to_flooded == -1:
-                        neighbor.distance_to_flooded = distance
-                        newset.add(neighbor)
-            curset = newset
-            distance += 1
+            fields[layer] = bitboard.distance_field(present, zero, one)
 
+        return fields
 
-    def calculate_distance_to_land(self):
+
+    def compute_distance_layers(self, layers=DISTANCE_LAYERS):
         """
-        Marks all node with their respective distance to a dry node
+        Calculate the distance fields of all requested layers ('water',
+        'flooded' and 'land') with a single breadth first search.
+
+        Returns a dict which maps each layer to a flat array with one entry
+        per cell of the graph, indexed by index(x, y). Cells which are not
+        in the graph or not reachable have a distance of -1.
         """
 
-        curset = set()
+        for layer in layers:
+            if layer not in DISTANCE_LAYERS:
+                raise ValueError('unknown distance layer: {}'.format(layer))
+
+        if self._use_numpy():
+            return self._compute_distance_layers_with_numpy(layers)
+        if self._use_bitboard():
+            return self._compute_distance_layers_with_bitboard(layers)
 
+        size = self.rows * self.columns
+        water = array('i', [-1]) * size if 'water' in layers else None
+        flooded = array('i', [-1]) * size if 'flooded' in layers else None
+        land = array('i', [-1]) * size if 'land' in layers else None
+
+        # seed all layers in a single scan. current holds the nodes at
+        # distance 0, following the ones at distance 1 of every layer
+        current = dict((layer, []) for layer in layers)
+        following = dict((layer, []) for layer in layers)
         for node in self.nodes:
-            if node.is_dry:
-                node.distance_to_land = 0
-            elif node.is_next_to_land:
-                node.distance_to_land = 1
-                curset.add(node)
-
-        distance = 2
-        while curset:
-            newset = set()
-            for node in curset:
-                for neighbor in node.neighbors:
-                    if neighbor.distance_to_land == -1:
-                        neighbor.distance_to_land = distance
-                        newset.add(neighbor)
-            curset = newset
+            i = node.id
+            if water is not None:
+                if node.is_water:
+                    water[i] = 0
+                elif node.is_next_to_water:
+                    water[i] = 1
+                    following['water'].append(node)
+            if flooded is not None and node.state == State.flooded:
+                # flooded nodes and their neighbors have distance 0
+                for n in [node] + node.neighbors:
+                    j = n.id
+                    if flooded[j] != 0:
+                        flooded[j] = 0
+                        current['flooded'].append(n)
+            if land is not None:
+                if node.is_dry:
+                    land[i] = 0
+                elif node.is_next_to_land:
+                    land[i] = 1
+                    following['land'].append(node)
+
+        fields = {'water': water, 'flooded': flooded, 'land': land}
+
+        # expand the frontiers of all layers level by level
+        distance = 1
+        while any(current.itervalues()) or any(following.itervalues()):
+            for layer in layers:
+                field = fields[layer]
+                reached = following[layer]
+                for node in current[layer]:
+                    for neighbor in node.neighbors:
+                        i = neighbor.id
+                        if field[i] == -1:
+                            field[i] = distance
+                            reached.append(neighbor)
+            current = following
+            following = dict((layer, []) for layer in layers)
             distance += 1
 
+        return dict((layer, fields[layer]) for layer in layers)
 
-    def calculate_island_value(self):
+
+    def calculate_distances(self, layers=DISTANCE_LAYERS):
         """
-        Return a value for this graph.
+        Marks all node with their distances of the given layers, using a
+        single traversal for all of them
         """
 
-        value = 0
-        for node in self.nodes:
-            if node.state == State.flooded: value += 2
-            elif node.state == State.redry: value += 3
-            elif node.state == State.dry: value += 4
+        # tracked layers are always up to date
+        layers = [layer for layer in layers if layer not in self._tracked_layers]
+        if not layers:
+            return
 
-        return value
+        fields = self.compute_distance_layers(layers)
+        self.distance_fields.update(fields)
 
-    def get_middle(self):
+        for layer, field in fields.iteritems():
+            attribute = 'distance_to_' + layer
+            for node in self.nodes:
+                setattr(node, attribute, int(field[node.id]))
+
+    def track_distances(self, layers=DISTANCE_LAYERS):
         """
-        Return the node in the graph which has the best value
+        Calculate the distances of the given layers and keep them up to date
+        from now on. Whenever the state of a node changes only the distances
+        in the affected region are repaired.
         """
 
-        self.calculate_distance_to_water()
+        self._tracked_layers = ()
+        self.calculate_distances(layers)
 
-        middle = self.nodes[0]
-        for node in self.nodes:
-            if node.middle_value > middle.middle_value:
-                middle = node
+        for layer in layers:
+            self.distance_fields[layer] = array('i', list(self.distance_fields[layer]))
 
-        return middle
+        self._tracked_layers = tuple(layers)
 
 
-    def _add_path_to_cache(self, path, start, target):
+    def node_state_changed(self, node, old_state):
         """
-        Cache this path and split it into subpaths and cache them too
+        Called by node after its state changed from old_state
         """
 
-        distance = 0
-        reverse_path = {target: target}
+        self.version += 1
 
-        current = target
-        while current != start:
-            self._cached_distances[current][target] = distance
-            self._cached_distances[target][current] = distance
+        self.state_counts[old_state] -= 1
+        self.state_counts[node.state] += 1
 
-            self._cached_paths[current][target] = reverse_path.copy()
+        if self.zobrist is not None:
+            self.zobrist.node_state_changed(node, old_state)
 
-            next_node = path[current]
-            reverse_path[next_node] = current
+        for view in self._views.itervalues():
+            view.base_node_state_changed(node, old_state)
 
-            distance += 1
-
-            current = next_node
+        for layer in self._tracked_layers:
+            self._repair_distances(layer, node)
 
-        self._cached_paths[current][target] = reverse_path.copy()
-        self._cached_distances[current][target] = distance
-        self._cached_distances[target][current] = distance
+        if self.connectivity is not None and self.connectivity.graph is self:
+            self.connectivity.node_state_changed(node)
 
 
-    def _get_path_between(self, start, target):
+    def track_connectivity(self):
         """
-        Get the shortest path between start and target using A*
+        Label the components of the walkable nodes and keep the labels up to
+        date when nodes drown. Afterwards is_reachable only compares labels.
         """
 
-        if start in self._cached_paths and target in self._cached_paths[start]:
-            return self._cached_paths[start][target]
+        self.connectivity = Connectivity(self)
 
-        def min_distance(n1, n2):
-            return abs(n1.x - n2.x) + abs(n1.y - n2.y)
+    def track_hash(self, seed=0):
+        """
+        Keep a Zobrist hash of the states of all nodes and the position in
+        zobrist.value. It is updated with every change.
+        """
 
-        closedset = set()
-        openset = set([start])
-        path = {}
+        self.zobrist = Zobrist(self, seed)
 
-        g_score = {start: 0}
-        f_score = {start: min_distance(start, target)}
 
-        while openset:
+    def _repair_distances(self, layer, node):
+        """
+        Dynamic breadth first search: raise the distances which lost their
+        support because of the state change of node, then lower all
+        distances which can be improved starting from the changed nodes.
+        """
 
-            # find minimum
-            current = None
-            for node in openset:
-                if current is None:
-                    current = node
-                elif f_score[node] < f_score[current]:
-                    current = node
+        field = self.distance_fields[layer]
+        attribute = 'distance_to_' + layer
+        infinity = self.rows * self.columns + 1
+
+        def get(n):
+            d = field[n.id]
+            return infinity if d == -1 else d
+
+        def set_(n, d):
+            d = -1 if d >= infinity else d
+            field[n.id] = d
+            setattr(n, attribute, d)
+
+        def seed(n):
+            d = _distance_seed(layer, n)
+            return infinity if d is None else d
+
+        # only the seeds of node and its neighbors can have changed
+        changed = [node] + node.neighbors
+        seeds = dict((n.id, seed(n)) for n in changed)
+
+        # find the nodes which lost their support, in order of distance
+        heap = [(get(n), n.id, n) for n in changed
+                if seeds[n.id] > get(n)]
+        heapify(heap)
+
+        # affected nodes by id
+        affected = {}
+        while heap:
+            d, i, n = heappop(heap)
+            if i in affected:
+                continue
+
+            if seed(n) <= d:
+                continue
+            if any(get(w) == d - 1 and w.id not in affected for w in n.neighbors):
+                continue
+
+            affected[i] = n
+            for w in n.neighbors:
+                if get(w) == d + 1 and w.id not in affected:
+                    heappush(heap, (d + 1, w.id, w))
+
+        for n in affected.itervalues():
+            set_(n, infinity)
+
+        # lower the distances again, starting from the affected and the
+        # changed nodes
+        heap = []
+        for n in affected.itervalues():
+            d = min([seed(n)] + [get(w) + 1 for w in n.neighbors])
+            if d < infinity:
+                set_(n, d)
+                heap.append((d, n.id, n))
+        for n in changed:
+            if seeds[n.id] < get(n):
+                set_(n, seeds[n.id])
+                heap.append((seeds[n.id], n.id, n))
+        heapify(heap)
+
+        while heap:
+            d, _, n = heappop(heap)
+            if d != get(n):
+                continue
+            for w in n.neighbors:
+                if d + 1 < get(w):
+                    set_(w, d + 1)
+                    heappush(heap, (d + 1, w.id, w))
 
-            if current.x == target.x and current.y == target.y:
-                self._add_path_to_cache(path, start, target)
-                return self._cached_paths[start][target]
 
-            openset.remove(current)
-            closedset.add(current)
+    def calculate_distance_to_water(self):
+        """
+        Marks all node with their respective distance to water
+        """
 
-            for neighbor in current.neighbors:
-                if neighbor in closedset:
-                    continue
+        self.calculate_distances(('water',))
 
-                tentative_g_score = g_score[current] + 1
+    def calculate_distance_to_flooded(self):
+        """
+        Marks all node with their respective distance to a flooded node
+        """
 
-                if neighbor not in openset or tentative_g_score <= g_score[neighbor]:
-                    path[neighbor] = current
-                    g_score[neighbor] = tentative_g_score
-                    f_score[neighbor] = g_score[neighbor] + min_distance(neighbor, target)
-                    if neighbor not in openset:
-                        openset.add(neighbor)
+        self.calculate_distances(('flooded',))
 
-        self._cached_paths[start][target] = None
-        self._cached_paths[target][start] = None
-        self._cached_distances[start][target] = -1
-        self._cached_distances[target][start] = -1
+    def calculate_distance_to_land(self):
+        """
+        Marks all node with their respective distance to a dry node
+        """
 
-        return None
+        self.calculate_distances(('land',))
 
 
-    def get_distance_between(self, start, target):
+    def calculate_island_value(self):
+        """
+        Return a value for this graph.
+        """
+
+        counts = self.state_counts
+        return (2 * counts[State.flooded] + 3 * counts[State.redry] +
+                4 * counts[State.dry])
+
+    def get_middle(self):
+        """
+        Return the node in the graph which has the best middle value. The
+        result is kept until the state of a node changes.
+        """
+
+        if self._middle_version != self.version:
+            self.calculate_distance_to_water()
+
+            if self._use_numpy():
+                self._middle = self._get_middle_with_numpy()
+            else:
+                self._middle = self._get_middle()
+            self._middle_version = self.version
+
+        return self._middle
+
+    def _get_middle(self):
+
+        field = self.distance_fields['water']
+        water = (State.flooded, State.drowned)
+
+        middle = None
+        best = -1
+        for node in self.nodes:
+            if node.state in water:
+                value = 0
+            else:
+                value = 1
+                for neighbor in node.neighbors:
+                    value += field[neighbor.id]
+
+            if value > best:
+                middle = node
+                best = value
+
+        return middle
+
+    def _get_middle_with_numpy(self):
+
+        states = numpy.frombuffer(self._state_cells(), dtype=numpy.uint8)
+        states = states.reshape((self.rows, self.columns))
+        present = states != 0
+
+        distance = numpy.frombuffer(self.distance_fields['water'], dtype=numpy.int32)
+        distance = numpy.where(present, distance.reshape(states.shape), 0)
+
+        # Node.middle_value for all nodes at once, cells which are not in the
+        # graph get -1 so they are never chosen
+        values = 1 + (_shift(distance, 1, 0) + _shift(distance, -1, 0) +
+                      _shift(distance, 0, 1) + _shift(distance, 0, -1))
+        values[(states == ord(State.flooded)) | (states == ord(State.drowned))] = 0
+        values[~present] = -1
+
+        # ties go to the first node in row-major order
+        y, x = numpy.unravel_index(numpy.argmax(values), values.shape)
+        return self.get_node(self.x0 + int(x), self.y0 + int(y))
+
+
+    def _search_path_tree(self, start, target):
+        """
+        Search a shortest path between start and target using A*. The search
+        runs from target towards start, so the resulting tree is rooted at
+        target and holds the next step towards target for every node on the
+        path. The tree is added to the path cache.
+        """
+
+        def min_distance(n1, n2):
+            return abs(n1.x - n2.x) + abs(n1.y - n2.y)
+
+        # the tables are indexed by node id and kept for the next search. An
+        # entry of g_score and path only counts if its seen stamp is the
+        # generation of this search, a node is closed if its closed stamp is
+        if self._search_tables is None:
+            size = self.rows * self.columns
+            self._search_tables = (array('i', [0]) * size, array('i', [0]) * size,
+                                   array('i', [0]) * size, [None] * size)
+        seen, closed, g_score, path = self._search_tables
+
+        self._search_generation += 1
+        generation = self._search_generation
+
+        closed_ids = []
+
+        seen[target.id] = generation
+        g_score[target.id] = 0
+        path[target.id] = None
+
+        # entries are (f, h, insertion order, node). Ties are broken towards
+        # start first and then in insertion order. Outdated entries stay in
+        # the heap and are skipped when they are popped.
+        h = min_distance(target, start)
+        openheap = [(h, h, 0, target)]
+        counter = 1
+
+        complete = True
+        while openheap:
+
+            f, h, _, current = heappop(openheap)
+            i = current.id
+            if closed[i] == generation or f != g_score[i] + h:
+                continue
+
+            closed[i] = generation
+            closed_ids.append(i)
+
+            if i == start.id:
+                complete = False
+                break
+
+            tentative_g_score = g_score[i] + 1
+            for neighbor in current.neighbors:
+                j = neighbor.id
+                if closed[j] == generation:
+                    continue
+
+                if seen[j] != generation or tentative_g_score < g_score[j]:
+                    seen[j] = generation
+                    path[j] = current
+                    g_score[j] = tentative_g_score
+                    h = min_distance(neighbor, start)
+                    heappush(openheap, (tentative_g_score + h, h, counter, neighbor))
+                    counter += 1
+
+        # only the distances of closed nodes are known to be the shortest
+        predecessors = dict((i, path[i]) for i in closed_ids)
+        distances = dict((i, g_score[i]) for i in closed_ids)
+
+        tree = PathTree(target, predecessors, distances, complete)
+        self.path_cache.add(tree)
+        return tree
+
+    def _get_path_tree(self, start, target):
+
+        tree = self.path_cache.find(start, target)
+        if tree is None:
+            tree = self._search_path_tree(start, target)
+        return tree
+
+
+    def get_distance_between(self, start, target):
         """
         Get the shortest distance between start and target
         """
 
-        if start in self._cached_distances and target in self._cached_distances[start]:
-            return self._cached_distances[start][target]
+        start = self.get_node(start.x, start.y)
+        target = self.get_node(target.x, target.y)
+        if start is None or target is None:
+            return -1
+
+        tree = self._get_path_tree(start, target)
+        other = start if tree.root.id == target.id else target
+        return tree.distances.get(other.id, -1)
+
+    def distances_from(self, source, max_depth=None):
+        """
+        Return a dict which maps every node reachable from source to its
+        shortest distance from source. If max_depth is given only nodes up to
+        that distance are included.
+        """
+
+        source = self.get_node(source.x, source.y)
+        if source is None:
+            return {}
+
+        # keyed by node id
+        distances = {source.id: 0}
+        predecessors = {source.id: None}
+
+        reached = [source]
 
-        path = self._get_path_between(start, target)
-        if path is None:
+        frontier = [source]
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            following = []
+            for node in frontier:
+                for neighbor in node.neighbors:
+                    if neighbor.id not in distances:
+                        distances[neighbor.id] = depth
+                        predecessors[neighbor.id] = node
+                        following.append(neighbor)
+            reached.extend(following)
+            frontier = following
+
+        # the search doubles as a shortest path tree for later queries
+        self.path_cache.add(PathTree(source, predecessors, distances, not frontier))
+
+        return dict((node, distances[node.id]) for node in reached)
+
+    def component_of(self, node):
+        """
+        Return the label of the connected component of the node at the
+        position of node, -1 if there is none. If the connectivity is
+        tracked, only walkable nodes are taken into account. Otherwise the
+        components are labeled once until the state of a node changes.
+        """
+
+        if self.connectivity is not None:
+            return self.connectivity.component_of(node)
+
+        node = self.get_node(node.x, node.y)
+        if node is None:
             return -1
-        else:
-            return self._cached_distances[start][target]
+
+        if self._component_labels_version != self.version:
+            self._component_labels, _ = label_components(self)
+            self._component_labels_version = self.version
+
+        return self._component_labels[node.id]
 
     def is_reachable(self, start, target):
         """
         Return whether target is reachable from start or not
         """
 
-        return self.get_distance_between(start, target) != -1
+        label = self.component_of(start)
+        return label != -1 and label == self.component_of(target)
 
 
     def get_next_node_on_path_to(self, start, target):
@@ -572,165 +1476,721 @@ class Graph(object):
         If it is not possible return None
         """
 
-        path = self._get_path_between(start, target)
-        if path is None:
+        start = self.get_node(start.x, start.y)
+        target = self.get_node(target.x, target.y)
+        if start is None or target is None:
             return None
-        else:
-            return path[start]
 
+        tree = self._get_path_tree(start, target)
+        if start.id not in tree.distances and tree.root.id != start.id:
+            return None
 
+        if start == target:
+            return start
 
-def make_walkable(graph):
+        if tree.root.id == target.id:
+            return tree.predecessors[start.id]
+        return tree.next_node_from_root(target)
+
+
+
+class NodeView(Node):
     """
-    Transform a graph to only contain nodes, that the bot can enter.
-    Returns a new graph and leaves the old one untouched
+    A node of a GraphView. The state is the one of the node in the
+    underlying graph, the neighbors are the ones which are part of the view.
+    Properties are cached until the state of any node in the underlying graph
+    changes.
     """
 
-    nodes = []
+    def __init__(self, view, node):
 
-    for row in graph._nodes:
-        nodes.append([])
-        for node in row:
-            if node is None or node.state == State.drowned:
-                nodes[-1].append(None)
-            else:
-                nodes[-1].append(Node.from_node(node))
+        self._view = view
+        self._node = node
 
-    return Graph(nodes)
+        self.x = node.x
+        self.y = node.y
+        self.id = node.id
 
+        self.graph = view
 
-def make_dry(graph):
+        self._neighbors = []
+
+        self._is_water = False
+        self._is_dry = False
+        self._is_next_to_water = False
+        self._is_next_to_land = False
+
+        self._properties_version = -1
+        self._neighbors_version = -1
+
+    @property
+    def _state(self):
+        return self._node.state
+
+    @property
+    def state(self):
+        return self._node.state
+
+    @state.setter
+    def state(self, state):
+        old_state = self._node.state
+        if state == old_state:
+            return
+
+        self._node.state = state
+        self._view.node_state_changed(self, old_state)
+
+    # the distances are read from the distance fields of the view, so they
+    # are -1 again as soon as the states they were calculated for changed
+    @property
+    def distance_to_water(self):
+        return self._view.get_distance('water', self)
+
+    @distance_to_water.setter
+    def distance_to_water(self, distance):
+        self._view.set_distance('water', self, distance)
+
+    @property
+    def distance_to_flooded(self):
+        return self._view.get_distance('flooded', self)
+
+    @distance_to_flooded.setter
+    def distance_to_flooded(self, distance):
+        self._view.set_distance('flooded', self, distance)
+
+    @property
+    def distance_to_land(self):
+        return self._view.get_distance('land', self)
+
+    @distance_to_land.setter
+    def distance_to_land(self, distance):
+        self._view.set_distance('land', self, distance)
+
+    @property
+    def should_recalculate_node_properties(self):
+        return self._properties_version != self._view.base.version
+
+    @should_recalculate_node_properties.setter
+    def should_recalculate_node_properties(self, value):
+        self._properties_version = -1 if value else self._view.base.version
+
+    @property
+    def should_update_neighbors(self):
+        return self._neighbors_version != self._view.base.version
+
+    @should_update_neighbors.setter
+    def should_update_neighbors(self, value):
+        self._neighbors_version = -1 if value else self._view.base.version
+
+    @property
+    def neighbors(self):
+        if self.should_update_neighbors:
+            _neighbors = (self.north, self.east, self.south, self.west)
+            self._neighbors = [n for n in _neighbors if n is not None]
+            self.should_update_neighbors = False
+        return self._neighbors
+
+    @property
+    def north(self):
+        return self._view.get_node(self.x, self.y - 1)
+
+    @property
+    def east(self):
+        return self._view.get_node(self.x + 1, self.y)
+
+    @property
+    def south(self):
+        return self._view.get_node(self.x, self.y + 1)
+
+    @property
+    def west(self):
+        return self._view.get_node(self.x - 1, self.y)
+
+    def __repr__(self):
+        return 'NodeView({}, {})'.format(self.x, self.y)
+
+
+class GraphView(Graph):
     """
-    Transform a graph into a graph which only contains nodes that are dry
+    A graph which only contains the nodes of another graph whose state is
+    one of states. It does not copy anything: the states are shared with the
+    underlying graph and neighbors are filtered on the fly. So creating a
+    view is O(1) and state changes made through it are visible in both.
     """
 
-    nodes = []
+    def __init__(self, graph, states):
 
-    for row in graph._nodes:
-        nodes.append([])
-        for node in row:
-            if node is None or node.state in (State.flooded, State.drowned):
-                nodes[-1].append(None)
-            else:
-                nodes[-1].append(Node.from_node(node))
+        if isinstance(graph, GraphView):
+            states = [state for state in states if state in graph.states]
+            graph = graph.base
 
-    return Graph(nodes)
+        self.base = graph
+        self.states = frozenset(states)
 
+        self.rows = graph.rows
+        self.columns = graph.columns
 
-def make_flooded(graph):
+        self.x0 = graph.x0
+        self.y0 = graph.y0
+        self.offset = graph.offset
 
-    nodes = []
+        self._init_caches()
 
-    for row in graph._nodes:
-        nodes.append([])
-        for node in row:
-            if node is None or node.state != State.flooded:
-                nodes[-1].append(None)
-            else:
-                nodes[-1].append(Node.from_node(node))
+        self._view_nodes = {}
 
-    return Graph(nodes)
+        self._nodes_list = []
+        self._nodes_version = -1
 
+        # the base version each distance field was calculated for
+        self._distance_versions = {}
 
+    def get_node(self, x, y):
 
+        node = self.base.get_node(x, y)
+        if node is None or node.state not in self.states:
+            return None
 
-def update_extended_islands(node, island, islands):
+        view_node = self._view_nodes.get(node.id)
+        if view_node is None:
+            view_node = self._view_nodes[node.id] = NodeView(self, node)
 
-    dry_states = (State.dry, State.redry)
+        return view_node
 
-    if (node.state in dry_states or
-        any(n.state in dry_states and n in island for n in node.neighbors)):
+    @property
+    def nodes(self):
+        if self._nodes_version != self.base.version:
+            self._nodes_list = [self.get_node(node.x, node.y)
+                                for node in self.base.nodes
+                                if node.state in self.states]
+            self._nodes_version = self.base.version
+        return self._nodes_list
 
-        if node.distance_to_land > 1:
-            for ext_island in islands:
-                if node in ext_island:
-                    ext_island.remove(node)
+    @property
+    def state_counts(self):
+        # the underlying graph counts the nodes of every state already
+        counts = defaultdict(int)
+        for state in self.states:
+            counts[state] = self.base.state_counts[state]
+        return counts
 
-        island.add(node)
+    def view(self, states):
+        return self.base.view(self.states.intersection(states))
 
-        node.distance_to_land = 1
+    def _get_distance_field(self, layer):
+        """
+        Return the distance field of layer if it fits the current states,
+        otherwise None
+        """
 
-    for neighbor in node.neighbors:
-        if neighbor.state == State.flooded:
-            if node.state in dry_states:
-                update_extended_islands(neighbor, island, islands)
-            elif neighbor.distance_to_land == node.distance_to_land + 1:
-                if neighbor not in island:
-                    island.add(neighbor)
-            elif (neighbor.distance_to_land == -1 or
-                  neighbor.distance_to_land > node.distance_to_land + 1):
-                neighbor.distance_to_land = node.distance_to_land + 1
+        field = self.distance_fields.get(layer)
+        if field is None:
+            return None
+        if (layer in self._tracked_layers or
+                self._distance_versions.get(layer) == self.base.version):
+            return field
+        return None
 
-                for ext_island in islands:
-                    if neighbor in ext_island:
-                        ext_island.remove(neighbor)
-                island.add(neighbor)
-                update_extended_islands(neighbor, island, islands)
+    def get_distance(self, layer, node):
 
+        field = self._get_distance_field(layer)
+        if field is None:
+            return -1
+        return int(field[node.id])
 
+    def set_distance(self, layer, node, distance):
 
-def split_into_extended_islands(graph):
+        field = self._get_distance_field(layer)
+        if field is None:
+            field = array('i', [-1]) * (self.rows * self.columns)
+            self.distance_fields[layer] = field
+            self._distance_versions[layer] = self.base.version
+
+        field[node.id] = distance
+
+    def calculate_distances(self, layers=DISTANCE_LAYERS):
+
+        # the nodes read their distances from the fields
+        layers = [layer for layer in layers if layer not in self._tracked_layers]
+        if not layers:
+            return
+
+        for layer, field in self.compute_distance_layers(layers).iteritems():
+            self.distance_fields[layer] = field
+            self._distance_versions[layer] = self.base.version
+
+    def base_node_state_changed(self, node, old_state):
+        """
+        Called by the underlying graph after the state of node changed
+        """
+
+        self.version += 1
+
+        entered = node.state in self.states
+        left = old_state in self.states
+        if entered:
+            view_node = self.get_node(node.x, node.y)
+            self.path_cache.node_added(view_node)
+        else:
+            view_node = self._view_nodes.get(self.index(node.x, node.y))
+            if view_node is not None:
+                self.path_cache.node_removed(view_node)
+
+        if not self._tracked_layers:
+            return
+
+        if entered and left:
+            for layer in self._tracked_layers:
+                self._repair_distances(layer, view_node)
+        elif entered or left:
+            # the neighbors of the nodes around changed
+            self.track_distances(self._tracked_layers)
+
+    def node_state_changed(self, node, old_state):
+
+        # the underlying graph already told the view about the change
+        pass
+
+    def add_node(self, node):
+        raise TypeError('nodes can not be added to a view')
+
+    def remove_node(self, node):
+        raise TypeError('nodes can not be removed from a view')
+
+
+def make_walkable(graph):
+    """
+    Return a view of graph which only contains nodes that the bot can enter
+    """
+
+    walkable = graph.view((State.dry, State.redry, State.flooded))
+
+    # the walkable components stay the same
+    walkable.connectivity = graph.connectivity
+
+    return walkable
+
+
+def make_dry(graph):
+    """
+    Return a view of graph which only contains nodes that are dry
+    """
+
+    return graph.view((State.dry, State.redry))
+
+
+def make_flooded(graph):
+    """
+    Return a view of graph which only contains nodes that are flooded
+    """
+
+    return graph.view((State.flooded,))
+
+
+def _copy_nodes(nodes):
+    """
+    Return a new graph with copies of nodes. The graph only covers the
+    bounding box of the nodes, so its size does not depend on the board.
+    """
+
+    x0 = min(node.x for node in nodes)
+    y0 = min(node.y for node in nodes)
+    columns = max(node.x for node in nodes) - x0 + 1
+    rows = max(node.y for node in nodes) - y0 + 1
+
+    grid = [[None] * columns for _ in xrange(rows)]
+    for node in nodes:
+        grid[node.y - y0][node.x - x0] = Node.from_node(node)
+
+    return Graph(grid, x0, y0)
+
+
+def split_into_extended_islands(graph, out_of_time=None):
+    """
+    Split graph into its extended islands. An extended island consists of a
+    dry island and all flooded nodes which are nearer to it than to any other
+    dry island, walking over flooded nodes only. Nodes with the same distance
+    to several dry islands belong to all of them.
+
+    out_of_time is called between the steps of the search, once it returns
+    True the search is given up and None is returned.
+    """
 
     walkable = make_walkable(graph)
     dry = make_dry(graph)
-    dry_islands = split_into_subgraphs(dry)
+    labelled = label_components(dry, out_of_time)
+    if labelled is None:
+        return None
+    _, dry_islands = labelled
+
+    # multi source breadth first search over the flooded nodes, every node
+    # remembers the dry islands it is nearest to
+    members = []
+    current = {}
+    for label, dry_island in enumerate(dry_islands):
+        if out_of_time is not None and out_of_time():
+            return None
 
-    extended_islands = []
-    for dry_island in dry_islands:
-        extended_island = set()
+        members.append([])
         for node in dry_island.nodes:
             walkable_node = walkable.get_node(node.x, node.y)
+            walkable_node.distance_to_land = 0
+            members[label].append(walkable_node)
+            current[walkable_node.id] = (walkable_node, (label,))
+
+    # current and following map node ids to the node and its islands
+    reached = bytearray(walkable.rows * walkable.columns)
+    for i in current:
+        reached[i] = 1
+
+    distance = 1
+    while current:
+        following = {}
+        for count, (node, labels) in enumerate(current.itervalues()):
+            # asking for the time at every node would be too slow
+            if count % 1024 == 0 and out_of_time is not None and out_of_time():
+                return None
+
+            for neighbor in node.neighbors:
+                i = neighbor.id
+                if neighbor.state == State.flooded and not reached[i]:
+                    if i not in following:
+                        following[i] = (neighbor, set())
+                    following[i][1].update(labels)
+
+        for i, (node, labels) in following.iteritems():
+            node.distance_to_land = distance
+            reached[i] = 1
+            for label in labels:
+                members[label].append(node)
+
+        current = following
+        distance += 1
 
-            extended_island.add(walkable_node)
+    islands = []
+    for island_nodes in members:
+        if out_of_time is not None and out_of_time():
+            return None
+        islands.append(_copy_nodes(island_nodes))
 
-        extended_islands.append(extended_island)
+    return islands
 
 
-    for extended_island in extended_islands:
-        for node in list(extended_island):
-            update_extended_islands(node, extended_island, extended_islands)
+class Component(object):
+    """
+    A connected component of a graph as found by label_components
+    """
 
+    def __init__(self, label):
 
-    islands = []
-    for ext_island in extended_islands:
-        nodes = [[None for _ in xrange(graph.columns)] for _ in xrange(graph.rows)]
-        for node in ext_island:
-            nodes[node.y][node.x] = node
+        self.label = label
+
+        self.nodes = []
+        self.state_counts = defaultdict(int)
 
-        islands.append(Graph(nodes))
+        self.min_x = self.min_y = None
+        self.max_x = self.max_y = None
 
-    return islands
+        self._graph = None
 
+    def add(self, node):
 
+        self.nodes.append(node)
+        self.state_counts[node.state] += 1
+
+        if self.min_x is None:
+            self.min_x = self.max_x = node.x
+            self.min_y = self.max_y = node.y
+        else:
+            self.min_x = min(self.min_x, node.x)
+            self.max_x = max(self.max_x, node.x)
+            self.min_y = min(self.min_y, node.y)
+            self.max_y = max(self.max_y, node.y)
 
-def _find_connected(node, visited):
+    @property
+    def size(self):
+        return len(self.nodes)
 
-    visited.add(node)
-    for neighbor in node.neighbors:
-        if neighbor not in visited:
-            _find_connected(neighbor, visited)
+    @property
+    def bounding_box(self):
+        return (self.min_x, self.min_y, self.max_x, self.max_y)
 
-def split_into_subgraphs(graph):
+    @property
+    def graph(self):
+        """
+        The component as a Graph of its own with copies of the nodes. It is
+        only built on first access.
+        """
+
+        if self._graph is None:
+            self._graph = _copy_nodes(self.nodes)
+
+        return self._graph
+
+
+def label_components(graph, out_of_time=None):
+    """
+    Label the connected components of graph with an iterative flood fill.
+
+    Returns a flat array with the label of every cell (indexed by
+    graph.index(x, y), -1 for cells which are not in the graph) and the list
+    of components, where the component with label i is at position i.
+
+    out_of_time is called before each component, once it returns True the
+    labelling is given up and None is returned.
+    """
 
-    subgraphs = []
-    nodes = set(graph.nodes)
-    while nodes:
-        node = nodes.pop()
+    labels = array('i', [-1]) * (graph.rows * graph.columns)
+    components = []
 
-        visited = set()
-        _find_connected(node, visited)
+    for node in graph.nodes:
+        if labels[node.id] != -1:
+            continue
+        if out_of_time is not None and out_of_time():
+            return None
+
+        component = Component(len(components))
+        components.append(component)
+
+        labels[node.id] = component.label
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            component.add(current)
+            for neighbor in current.neighbors:
+                i = neighbor.id
+                if labels[i] == -1:
+                    labels[i] = component.label
+                    stack.append(neighbor)
+
+    return labels, components
+
+
+class Connectivity(object):
+    """
+    Labels of the connected components formed by the walkable nodes of a
+    graph. Fields never become walkable again once they drowned, so
+    components only ever split. When a node drowns only the parts which
+    split off its component are labeled again.
+    """
+
+    def __init__(self, graph):
+
+        self.graph = graph
+        self.columns = graph.columns
+        self.offset = graph.offset
+
+        self.labels = array('i', [-1]) * (graph.rows * graph.columns)
+        self._next_label = 0
+
+        for node in graph.nodes:
+            if node.state != State.drowned and self.component_of(node) == -1:
+                self._label_component(node)
+
+    def component_of(self, node):
+        """
+        Return the label of the component of node, -1 if it is not walkable
+        """
+
+        return self.labels[node.y * self.columns + node.x - self.offset]
+
+    def is_reachable(self, start, target):
+
+        label = self.component_of(start)
+        return label != -1 and label == self.component_of(target)
+
+    def _label_component(self, node):
+        """
+        Give a new label to node and all walkable nodes connected to it
+        """
+
+        label = self._next_label
+        self._next_label += 1
+
+        labels = self.labels
+
+        labels[node.id] = label
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for neighbor in current.neighbors:
+                i = neighbor.id
+                if labels[i] != label and neighbor.state != State.drowned:
+                    labels[i] = label
+                    stack.append(neighbor)
+
+    def node_state_changed(self, node):
+
+        i = node.id
+        walkable = node.state != State.drowned
+        if walkable == (self.labels[i] != -1):
+            return
+
+        if walkable:
+            # should not happen in a game, merge all adjacent components
+            self._label_component(node)
+            return
+
+        old_label = self.labels[i]
+        self.labels[i] = -1
+
+        neighbors = [n for n in node.neighbors if n.state != State.drowned]
+        if len(neighbors) < 2:
+            return
+
+        self._split(neighbors)
+
+    def _split(self, starts):
+        """
+        Find out whether the nodes in starts are still connected. One breadth
+        first search runs from every start node, taking turns node by node.
+        Searches which meet are merged. A search which runs out of nodes
+        before all others met it found a part of its own, which gets a new
+        label. The last search left keeps the old label, so only the smaller
+        parts are ever visited completely.
+        """
+
+        labels = self.labels
+
+        # search index by node id, searches which met are joined with parent
+        owner = {}
+        parent = range(len(starts))
+
+        def find(j):
+            while parent[j] != j:
+                j = parent[j]
+            return j
+
+        # frontier and visited node ids of every running search
+        searches = {}
+        for j, start in enumerate(starts):
+            owner[start.id] = j
+            searches[j] = (deque([start]), [start.id])
+
+        while len(searches) > 1:
+            for j in list(searches):
+                if j not in searches:
+                    continue
+
+                frontier, visited = searches[j]
+                if not frontier:
+                    label = self._next_label
+                    self._next_label += 1
+                    for i in visited:
+                        labels[i] = label
+                    del searches[j]
+                    if len(searches) == 1:
+                        break
+                    continue
+
+                current = frontier.popleft()
+                for neighbor in current.neighbors:
+                    if neighbor.state == State.drowned:
+                        continue
+
+                    i = neighbor.id
+                    other = owner.get(i)
+                    if other is None:
+                        owner[i] = j
+                        visited.append(i)
+                        frontier.append(neighbor)
+                        continue
+
+                    other = find(other)
+                    if other != j:
+                        # the searches met, so their parts are one
+                        parent[other] = j
+                        other_frontier, other_visited = searches.pop(other)
+                        frontier.extend(other_frontier)
+                        visited.extend(other_visited)
+                        if len(searches) == 1:
+                            break
+
+
+class Zobrist(object):
+    """
+    Zobrist hash of the states of the nodes of a graph and its position.
+    Every state of every cell and every position has a random 64 bit key and
+    value is the xor of the keys which apply, so a change only takes two
+    xors. Equal boards with equal positions have equal values.
+    """
+
+    def __init__(self, graph, seed=0):
+
+        rnd = random.Random(seed)
+        size = graph.rows * graph.columns
+
+        self.graph = graph
+        self.state_keys = {}
+        for state in (State.dry, State.flooded, State.drowned, State.redry):
+            self.state_keys[state] = [rnd.getrandbits(64) for _ in xrange(size)]
+        self.position_keys = [rnd.getrandbits(64) for _ in xrange(size)]
+
+        self.value = 0
+        for node in graph.nodes:
+            self.value ^= self.state_keys[node.state][node.id]
+        self.position_changed(None, graph.position)
+
+    def node_state_changed(self, node, old_state):
+
+        self.value ^= (self.state_keys[old_state][node.id] ^
+                       self.state_keys[node.state][node.id])
+
+    def position_changed(self, old_position, position):
 
-        for node in visited:
-            if node in nodes:
-                nodes.remove(node)
+        for p in (old_position, position):
+            if p is not None:
+                self.value ^= self.position_keys[self.graph.index(*p)]
 
-        # build 2-dimensional list from visited nodes
-        n = [[None for i in xrange(graph.columns)] for j in xrange(graph.rows)]
-        for node in visited:
-            n[node.y][node.x] = node
 
-        subgraphs.append(Graph(n))
+class TranspositionTable(object):
+    """
+    Maps hash values of game states to what was found out about them. Holds
+    at most max_size entries, when there are more the least recently used
+    ones are evicted.
+    """
+
+    def __init__(self, max_size=None):
+
+        self.max_size = TRANSPOSITION_TABLE_SIZE if max_size is None else max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+
+        if key not in self._entries:
+            self.misses += 1
+            return default
 
-    return subgraphs
+        # mark as most recently used
+        value = self._entries.pop(key)
+        self._entries[key] = value
+
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+
+        self._entries.pop(key, None)
+        self._entries[key] = value
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def split_into_subgraphs(graph):
 
+    labels, components = label_components(graph)
+    return [component.graph for component in components]
 
@@ -8,8 +8,15 @@ Various strategies.
 :license: BSD, see LICENSE for more details.
 """
 
-from graph import (State, make_walkable, split_into_extended_islands,
-                   split_into_subgraphs, make_flooded)
+import time
+
+from graph import (State, TranspositionTable, make_walkable,
+                   split_into_extended_islands, split_into_subgraphs,
+                   make_flooded)
+
+
+# seconds MetaStrategy may spend on planning one round
+ROUND_BUDGET = 0.5
 
 
 def get_direction(current, target):
@@ -28,6 +35,17 @@ def get_direction(current, target):
         return 'CURRENT'
 
 
+def undo_dry_actions(graph, actions):
+    """
+    Give the fields dried by actions their flooded state back. Strategies
+    only ever dry flooded fields.
+    """
+
+    for action, x, y in actions:
+        if action.startswith('DRY'):
+            graph.get_node(x, y).state = State.flooded
+
+
 
 class Strategy(object):
 
@@ -37,8 +55,17 @@ class Strategy(object):
         self.position = (0, 0)
         self.floodlevel = 0
 
+        # FloodCards with the flood probabilities of the fields, if known
+        self.flood_cards = None
+
         self.extended_islands = None
 
+        # time.time() at which planning has to stop, if any
+        self.deadline = None
+
+        # planning stops as well once this threading.Event is set
+        self.stopped = None
+
         self.debug = debug
         self.round_ = round_
 
@@ -61,9 +88,16 @@ class Strategy(object):
         raise NotImplementedError()
 
 
+    def out_of_time(self):
+
+        if self.stopped is not None and self.stopped.is_set():
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+
     def split_graph_into_extended_islands(self, graph):
 
-        self.extended_islands = split_into_extended_islands(graph)
+        self.extended_islands = split_into_extended_islands(graph, self.out_of_time)
 
 
     def dry_one_if_possible(self, graph):
@@ -106,11 +140,11 @@ class Strategy(object):
     def find_target(self, graph):
 
         current_node = graph.get_node(*self.position)
+        component = graph.component_of(current_node)
 
         target_island = None
         for island in self.extended_islands:
-            other_node = graph.get_node(island.nodes[0].x, island.nodes[0].y)
-            if not graph.is_reachable(current_node, other_node):
+            if graph.component_of(island.nodes[0]) != component:
                 continue
 
             if target_island is None:
@@ -143,12 +177,12 @@ class DryMaxStrategy(Strategy):
         while len(self.actions) < 3:
 
             if len(current_node.neighbors) == 0:
-                self.do('GO', 'CURRENT')
+                self.do('GO', 'CURRENT', current_node.x, current_node.y)
                 continue
 
             next_node = min(current_node.neighbors, key=lambda n: n.distance_to_flooded)
             direction = get_direction(current_node, next_node)
-            self.do('GO', direction)
+            self.do('GO', direction, next_node.x, next_node.y)
 
             current_node = next_node
 
@@ -159,17 +193,34 @@ class DryMaxStrategy(Strategy):
 
 class MetaStrategy(Strategy):
     """
-    Evaluates the current situation and chooses the right strategy
+    Evaluates the current situation and chooses the right strategy.
+
+    Planning is limited to budget seconds per round: the cheap DryMaxStrategy
+    always plans first, the better strategies are only used if they finish
+    in time. They stop planning as soon as the deadline passes. Rounds which
+    took longer anyway are recorded in overruns as (round, seconds).
+
+    If the graph tracks its hash, refined plans are kept in a transposition
+    table and reused whenever the same board and position come up again.
     """
 
+    def __init__(self, debug=False, round_=0, budget=ROUND_BUDGET):
+
+        super(MetaStrategy, self).__init__(debug, round_)
+
+        self.budget = budget
+        self.overruns = []
+
+        self.transpositions = TranspositionTable()
+
     def evaluate_mode(self, walkable, position):
 
         current_node = walkable.get_node(*position)
+        component = walkable.component_of(current_node)
 
         target_island = None
         for island in self.extended_islands:
-            other_node = walkable.get_node(island.nodes[0].x, island.nodes[0].y)
-            if not walkable.is_reachable(current_node, other_node): continue
+            if walkable.component_of(island.nodes[0]) != component: continue
 
             if target_island is None:
                 target_island = island
@@ -187,9 +238,79 @@ class MetaStrategy(Strategy):
 
     def get_actions(self, graph, position):
 
+        start = time.time()
+        deadline = start + self.budget
+
         walkable = make_walkable(graph)
 
+        key = None
+        if graph.zobrist is not None:
+            key = (graph.zobrist.value, position)
+
+        # a plan to fall back on, the strategies dry fields of the graph
+        # while planning so they are flooded again for the next one
+        fallback = DryMaxStrategy(self.debug, self.round_)
+        fallback.extended_islands = []
+        plan = (fallback.get_actions(walkable, position), 'DRYMAX')
+        undo_dry_actions(walkable, plan[0])
+
+        if key in self.transpositions:
+            refined = self.transpositions.get(key)
+            if refined is not None:
+                plan = refined
+        elif time.time() < deadline:
+            refined = self.refine(walkable, position, deadline, key)
+            if refined is not None:
+                plan = refined
+
+        elapsed = time.time() - start
+        if elapsed > self.budget:
+            self.overruns.append((self.round_, elapsed))
+
+        return plan
+
+
+    def ponder(self, graph, position, stopped=None):
+        """
+        Plan for graph and position ahead of time, e.g. for the state the
+        graph will be in next round. The plan goes into the transposition
+        table, so get_actions just looks it up. There is no budget, planning
+        only stops early once stopped (a threading.Event) is set. The graph
+        is left as it was.
+        """
+
+        if graph.zobrist is None:
+            return
+
+        key = (graph.zobrist.value, position)
+        if key in self.transpositions:
+            return
+
+        walkable = make_walkable(graph)
+        if walkable.get_node(*position) is None:
+            return
+
+        self.stopped = stopped
+        try:
+            refined = self.refine(walkable, position, None, key)
+        finally:
+            self.stopped = None
+
+        if refined is not None:
+            undo_dry_actions(walkable, refined[0])
+
+
+    def refine(self, walkable, position, deadline, key=None):
+        """
+        Plan with the strategy which fits the situation best. Return None if
+        that is DryMaxStrategy or planning ran out of time. Plans finished in
+        time are stored under key. deadline may be None for no time limit.
+        """
+
+        self.deadline = deadline
         self.split_graph_into_extended_islands(walkable)
+        if self.extended_islands is None or self.out_of_time():
+            return None
 
         mode = self.evaluate_mode(walkable, position)
 
@@ -198,10 +319,27 @@ class MetaStrategy(Strategy):
         elif mode == 'FARMING':
             strategy = FarmingStrategy(self.debug, self.round_)
         elif mode == 'DRYMAX':
-            strategy = DryMaxStrategy(self.debug, self.round_)
+            if key is not None:
+                self.transpositions.put(key, None)
+            return None
 
         strategy.extended_islands = self.extended_islands
-        return strategy.get_actions(walkable, position), mode
+        strategy.deadline = deadline
+        strategy.stopped = self.stopped
+        try:
+            actions = strategy.get_actions(walkable, position)
+        except Exception:
+            # the fields dried so far are part of no plan
+            undo_dry_actions(walkable, strategy.actions)
+            raise
+
+        if self.out_of_time():
+            undo_dry_actions(walkable, actions)
+            return None
+
+        if key is not None:
+            self.transpositions.put(key, (actions, mode))
+        return actions, mode
 
 
 class MovingStrategy(Strategy):
@@ -216,6 +354,9 @@ class MovingStrategy(Strategy):
 
         moved = False
         while len(self.actions) < 2 or (moved and len(self.actions) < 3):
+            if self.out_of_time():
+                return self.commit()
+
             if not self.dry_one_if_possible(graph):
                 moved = True
                 current_node = graph.get_node(*self.position)
@@ -248,6 +389,7 @@ class FarmingStrategy(Strategy):
         """
 
         x, y = current_node.x, current_node.y
+        distances = self.distances
 
         nearest_node = (None, -1)
 
@@ -258,10 +400,10 @@ class FarmingStrategy(Strategy):
             node = walkable.get_node(node.x, node.y)
 
             if nearest_node[0] is None:
-                distance = walkable.get_distance_between(current_node, node)
+                distance = distances.get(node, -1)
                 nearest_node = (node, distance)
             else:
-                distance = walkable.get_distance_between(current_node, node)
+                distance = distances.get(node, -1)
                 if distance < nearest_node[1]:
                     nearest_node = (node, distance)
 
@@ -294,7 +436,7 @@ class FarmingStrategy(Strategy):
         best_island = (None, -1)
         for island in self.flooded_islands:
             node = walkable.get_node(island.nodes[0].x, island.nodes[0].y)
-            if not walkable.is_reachable(current_node, node):
+            if node not in self.distances:
                 continue
 
             if best_island[0] is None:
@@ -318,6 +460,9 @@ class FarmingStrategy(Strategy):
 
         current_node = walkable.get_node(*self.position)
 
+        # one search answers all distance queries from our position
+        self.distances = walkable.distances_from(current_node)
+
         best_island = self.get_best_island(walkable, current_node)
         if best_island is None:
             return False
@@ -333,6 +478,8 @@ class FarmingStrategy(Strategy):
         if next_node is None:
             return False
 
+        direction = get_direction(current_node, next_node)
+        self.do('GO', direction, next_node.x, next_node.y)
 
         return True
 
@@ -343,6 +490,9 @@ class FarmingStrategy(Strategy):
         self.position = position
 
         while len(self.actions) < 3:
+            if self.out_of_time():
+                return self.commit()
+
             dried = False
             while len(self.actions) < 3 and self.dry_one_if_possible(graph):
                 dried = True
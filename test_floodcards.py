@@ -0,0 +1,82 @@
+import graph
+from floodcards import FloodCards
+
+
+board_str = '''
+##o
+#.#
+'''
+
+
+def test_initial_probabilities():
+
+    cards = FloodCards(graph.Board.from_string(board_str), level=2)
+
+    # five cards in the deck, the drowned field has none
+    assert cards.probability(0, 0) == 2.0 / 5
+    assert cards.probability(1, 1) == 0.0
+
+
+def test_reshuffled_cards_come_first():
+
+    board = graph.Board.from_string(board_str)
+    cards = FloodCards(board, level=1)
+
+    cards.card_drawn(0, 0, False)
+    cards.card_drawn(2, 0, True)
+    assert cards.probability(2, 0) == 0.0
+    assert cards.probability(0, 0) == 0.0
+    assert cards.probability(1, 0) == 1.0 / 3
+
+    # the discard pile goes on top of the deck
+    cards.increase_level(1)
+    assert cards.probability(0, 0) == 1.0
+    assert cards.probability(1, 0) == 1.0 / 3
+
+
+def test_empty_deck_uses_discard_pile():
+
+    board = graph.Board.from_string(board_str)
+    cards = FloodCards(board, level=1)
+
+    for x, y in ((0, 0), (1, 0), (2, 0), (0, 1), (2, 1)):
+        cards.card_drawn(x, y, False)
+
+    assert cards.probability(0, 0) == 1.0 / 5
+
+    cards.card_drawn(1, 0, False)
+    assert cards.probability(1, 0) == 0.0
+    assert cards.probability(0, 0) == 1.0 / 4
+
+
+def test_certain_floods():
+
+    board = graph.Board.from_string(board_str)
+    assert FloodCards(board, level=1).certain_floods() is None
+
+    cards = FloodCards(board, level=0)
+    assert cards.certain_floods() == []
+
+    # the reshuffled discard pile holds just the one card
+    cards.card_drawn(0, 0, False)
+    cards.increase_level(1)
+    assert cards.certain_floods() == [(0, 0)]
+
+
+def test_likely_floods():
+
+    board = graph.Board.from_string(board_str)
+    cards = FloodCards(board, level=1)
+
+    # any one of the five cards
+    floods = list(cards.likely_floods())
+    assert len(floods) == 5
+    assert floods[0] == [(0, 0)]
+
+    # the reshuffled discard pile is drawn first, then one of the others
+    cards.card_drawn(0, 0, False)
+    cards.increase_level(1)
+    floods = list(cards.likely_floods())
+    assert len(floods) == 4
+    assert all(fields[0] == (0, 0) for fields in floods)
+    assert [(1, 0), (2, 0), (0, 1), (2, 1)] == [fields[1] for fields in floods]
@@ -1,3 +1,7 @@
+import random
+
+import pytest
+
 import graph
 
 g1 = '''
@@ -88,6 +92,24 @@ def test_graph_from_board():
             assert node.y == y
 
 
+def test_board_from_string():
+
+    board = graph.Board.from_string(g2)
+
+    assert len(board) == board.rows == 6
+    assert board.columns == 6
+
+    for y, line in enumerate(g2.split()):
+        for x, state in enumerate(line):
+            assert board.get_state(x, y) == state
+            field = board[y][x]
+            assert (field.x, field.y, field.state) == (x, y, state)
+
+    # fields are views on the board
+    board[1][1].state = graph.State.flooded
+    assert board.get_state(1, 1) == graph.State.flooded
+
+
 def test_redry_node():
 
     board = graph.Board.from_string(g1)
@@ -102,6 +124,31 @@ def test_redry_node():
 
 
 
+def test_graph_flood_and_dry():
+    """
+    Test that flood and dry events keep a graph in sync with its board
+    """
+
+    board = graph.Board.from_string(g2)
+    g = graph.Graph.from_board(board)
+
+    assert not g.get_node(2, 2).is_next_to_water
+
+    for x, y in ((1, 1), (2, 1), (2, 1)):
+        board.flood(x, y)
+        g.flood(x, y)
+    board.dry(1, 1)
+    g.dry(1, 1)
+
+    for y in range(board.rows):
+        for x in range(board.columns):
+            assert g.get_node(x, y).state == board.get_state(x, y)
+
+    assert g.get_node(1, 1).state == graph.State.redry
+    assert g.get_node(2, 1).state == graph.State.drowned
+    assert g.get_node(2, 2).is_next_to_water
+
+
 def test_connections():
     """
     Test that nodes are connected correctly
@@ -249,6 +296,79 @@ def test_make_dry():
 
 
 
+def test_views_share_state():
+
+    board = graph.Board.from_string(g2)
+    g = graph.Graph.from_board(board)
+
+    walkable = graph.make_walkable(g)
+    dry = graph.make_dry(walkable)
+
+    assert dry.get_node(1, 2).north is dry.get_node(1, 1)
+    assert dry.get_node(2, 2).is_next_to_water is False
+
+    # flooding through the view floods the underlying graph
+    walkable.get_node(1, 1).state = graph.State.flooded
+    assert g.get_node(1, 1).state == graph.State.flooded
+
+    # and the other views follow
+    assert dry.get_node(1, 1) is None
+    assert dry.get_node(1, 2).north is None
+    assert len(dry.nodes) == 3*4 - 1
+    assert graph.make_flooded(g).get_node(1, 1) is not None
+
+    g.dry(1, 1)
+    assert dry.get_node(1, 1).state == graph.State.redry
+    assert dry.get_node(1, 2).north is dry.get_node(1, 1)
+
+    # the nodes of a view are the ones of the underlying graph
+    with pytest.raises(TypeError):
+        dry.remove_node(dry.get_node(1, 1))
+
+
+def test_view_distances_follow_state_changes():
+
+    board = graph.Board.from_string(g2)
+    g = graph.Graph.from_board(board)
+
+    walkable = graph.make_walkable(g)
+    walkable.calculate_distance_to_flooded()
+    assert walkable.get_node(2, 2).distance_to_flooded == 1
+
+    # the view is kept, its distances are not
+    g.flood(2, 1)
+    walkable = graph.make_walkable(g)
+    assert walkable.get_node(2, 2).distance_to_flooded == -1
+
+    walkable.calculate_distance_to_flooded()
+    assert walkable.get_node(2, 2).distance_to_flooded == 0
+
+
+def test_tracked_view_distances():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    g = graph.Graph.from_board(board)
+
+    walkable = graph.make_walkable(g)
+    walkable.track_distances()
+
+    # the changes are made through the base graph, like Wheatley does
+    random.seed(5)
+    for _ in xrange(100):
+        node = random.choice(g.nodes)
+        if random.random() < 0.7:
+            g.flood(node.x, node.y)
+        else:
+            g.dry(node.x, node.y)
+
+        expected = graph.Graph.from_graph(walkable).compute_distance_layers()
+        for n in walkable.nodes:
+            i = walkable.index(n.x, n.y)
+            assert n.distance_to_water == expected['water'][i]
+            assert n.distance_to_flooded == expected['flooded'][i]
+            assert n.distance_to_land == expected['land'][i]
+
+
 def test_subgraphs():
 
     board = graph.Board.from_string(g_sub)
@@ -270,6 +390,40 @@ def test_subgraphs():
 
 
 
+def test_label_components():
+
+    board = graph.Board.from_string(g_sub)
+    g = graph.make_walkable(graph.Graph.from_board(board))
+
+    labels, components = graph.label_components(g)
+
+    assert sorted(c.size for c in components) == [3, 9]
+    for component in components:
+        for node in component.nodes:
+            assert labels[g.index(node.x, node.y)] == component.label
+    assert labels[g.index(1, 1)] == -1
+
+    small = min(components, key=lambda c: c.size)
+    assert small.bounding_box == (0, 0, 1, 1)
+    assert small.state_counts == {graph.State.dry: 2, graph.State.redry: 1}
+    assert len(small.graph.nodes) == 3
+
+
+def test_label_components_large():
+    """
+    Large regions must not hit the recursion limit
+    """
+
+    board = graph.Board(120, 120)
+    g = graph.Graph.from_board(board)
+
+    labels, components = graph.label_components(g)
+
+    assert len(components) == 1
+    assert components[0].size == 120 * 120
+    assert components[0].bounding_box == (0, 0, 119, 119)
+
+
 def test_distance_to_water():
 
     board = graph.Board.from_string(g2)
@@ -402,6 +556,36 @@ def test_island_value():
     assert value in (1*3 + 2*4, 6*2 + 3*4)
 
 
+def test_island_value_follows_states():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    g = graph.Graph.from_board(board)
+    walkable = graph.make_walkable(g)
+    dry = graph.make_dry(g)
+    island = graph.split_into_subgraphs(walkable)[0]
+
+    def value(graph_):
+        total = 0
+        for node in graph_.nodes:
+            total += {graph.State.flooded: 2, graph.State.redry: 3,
+                      graph.State.dry: 4}.get(node.state, 0)
+        return total
+
+    random.seed(3)
+    for _ in xrange(200):
+        node = random.choice(g.nodes)
+        if random.random() < 0.7:
+            g.flood(node.x, node.y)
+        else:
+            g.dry(node.x, node.y)
+
+        node = random.choice(island.nodes)
+        node.state = random.choice([graph.State.dry, graph.State.flooded])
+
+        for graph_ in (g, walkable, dry, island):
+            assert graph_.calculate_island_value() == value(graph_)
+
+
 def test_contains_subgraph():
 
     board = graph.Board.from_string(g_sub)
@@ -499,6 +683,152 @@ def test_split_extended_islands_big():
 
 
 
+def test_compute_distance_layers():
+
+    for s in (g2, g_sub, g_big_cluttered):
+        g = graph.make_walkable(graph.Graph.from_board(graph.Board.from_string(s)))
+
+        layers = g.compute_distance_layers()
+        assert sorted(layers) == ['flooded', 'land', 'water']
+
+        g.calculate_distance_to_water()
+        g.calculate_distance_to_flooded()
+        g.calculate_distance_to_land()
+
+        for node in g.nodes:
+            i = g.index(node.x, node.y)
+            assert layers['water'][i] == node.distance_to_water
+            assert layers['flooded'][i] == node.distance_to_flooded
+            assert layers['land'][i] == node.distance_to_land
+
+        assert list(g.compute_distance_layers(('land',))) == ['land']
+
+
+def test_track_distances():
+    """
+    Test that repairing the distances after flood and dry events gives the
+    same result as calculating them from scratch
+    """
+
+    random.seed(5)
+
+    for s in (g2, g_sub, g_big_cluttered):
+        g = graph.make_walkable(graph.Graph.from_board(graph.Board.from_string(s)))
+        g.track_distances()
+
+        for _ in range(60):
+            x, y = random.randrange(g.columns), random.randrange(g.rows)
+            if random.random() < 0.7:
+                g.flood(x, y)
+            else:
+                g.dry(x, y)
+
+            expected = graph.Graph.from_graph(g).compute_distance_layers()
+            for layer in graph.DISTANCE_LAYERS:
+                assert list(g.distance_fields[layer]) == list(expected[layer])
+
+        for node in g.nodes:
+            i = g.index(node.x, node.y)
+            assert node.distance_to_water == expected['water'][i]
+            assert node.distance_to_flooded == expected['flooded'][i]
+            assert node.distance_to_land == expected['land'][i]
+
+
+def test_numpy_distance_fields(monkeypatch):
+    """
+    Test that the numpy engine computes the same distances as the plain
+    python search
+    """
+
+    pytest.importorskip('numpy')
+
+    for s in (g1, g2, g_sub, g_big, g_big_cluttered):
+        g = graph.Graph.from_board(graph.Board.from_string(s))
+        graphs = [g, graph.make_walkable(g)] + graph.split_into_subgraphs(graph.make_dry(g))
+
+        for g in graphs:
+            monkeypatch.setattr(graph, 'NUMPY_MIN_NODES', 10**9)
+            monkeypatch.setattr(graph, 'BITBOARD_MIN_NODES', 10**9)
+            g.calculate_distance_to_water()
+            g.calculate_distance_to_flooded()
+            g.calculate_distance_to_land()
+            expected = [(n.distance_to_water, n.distance_to_flooded, n.distance_to_land)
+                        for n in g.nodes]
+
+            copy = graph.Graph.from_graph(g)
+            monkeypatch.setattr(graph, 'NUMPY_MIN_NODES', 0)
+            copy.calculate_distance_to_water()
+            copy.calculate_distance_to_flooded()
+            copy.calculate_distance_to_land()
+            result = [(n.distance_to_water, n.distance_to_flooded, n.distance_to_land)
+                      for n in copy.nodes]
+
+            assert result == expected
+            for n in copy.nodes:
+                assert copy.distance_fields['water'][copy.index(n.x, n.y)] == n.distance_to_water
+
+
+
+def test_bitboard_distance_fields(monkeypatch):
+    """
+    Test that the bitboard engine computes the same distances as the plain
+    python search
+    """
+
+    monkeypatch.setattr(graph, 'NUMPY_MIN_NODES', 10**9)
+
+    for s in (g1, g2, g_sub, g_big, g_big_cluttered):
+        g = graph.Graph.from_board(graph.Board.from_string(s))
+        graphs = [g, graph.make_walkable(g)] + graph.split_into_subgraphs(graph.make_dry(g))
+
+        for g in graphs:
+            monkeypatch.setattr(graph, 'BITBOARD_MIN_NODES', 10**9)
+            expected = g.compute_distance_layers()
+            monkeypatch.setattr(graph, 'BITBOARD_MIN_NODES', 0)
+            assert g.compute_distance_layers() == expected
+
+
+def test_bitboard_indices():
+
+    from bitboard import Bitboard
+
+    bitboard = Bitboard(3, 40)
+    assert bitboard.indices(0) == []
+    assert bitboard.indices((1 << 119) | (1 << 64) | (1 << 63)) == [63, 64, 119]
+
+
+def test_islands_are_cropped():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    g = graph.Graph.from_board(board)
+
+    for island in graph.split_into_extended_islands(graph.make_walkable(g)):
+        xs = [node.x for node in island.nodes]
+        ys = [node.y for node in island.nodes]
+
+        assert (island.x0, island.y0) == (min(xs), min(ys))
+        assert island.columns == max(xs) - min(xs) + 1
+        assert island.rows == max(ys) - min(ys) + 1
+
+        for node in island.nodes:
+            assert island.get_node(node.x, node.y) is node
+        assert island.get_node(island.x0 - 1, island.y0) is None
+        assert island.get_node(island.x0, island.y0 + island.rows) is None
+
+        middle = island.get_middle()
+        assert island.get_node(middle.x, middle.y) is middle
+        assert island.calculate_island_value() > 0
+
+
+def test_extended_islands_out_of_time():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    walkable = graph.make_walkable(graph.Graph.from_board(board))
+
+    assert graph.split_into_extended_islands(walkable, lambda: True) is None
+    assert graph.split_into_extended_islands(walkable, lambda: False)
+
+
 def test_get_middle():
 
     board = graph.Board.from_string(g1)
@@ -518,6 +848,25 @@ def test_get_middle():
     assert middle.x in (2, 3)
     assert middle.y == 2
 
+    # the middle is kept until a node changes
+    assert g.get_middle() is middle
+    g.flood(middle.x, middle.y)
+    assert g.get_middle() is not middle
+
+
+def test_numpy_get_middle(monkeypatch):
+
+    pytest.importorskip('numpy')
+
+    for s in (g1, g2, g_big, g_big_cluttered):
+        g = graph.Graph.from_board(graph.Board.from_string(s))
+        for island in [g] + graph.split_into_extended_islands(g):
+            monkeypatch.setattr(graph, 'NUMPY_MIN_NODES', 10**9)
+            expected = island.get_middle()
+            monkeypatch.setattr(graph, 'NUMPY_MIN_NODES', 0)
+            island._middle_version = -1
+            assert island.get_middle() is expected
+
 
 def test_reachable():
 
@@ -549,6 +898,98 @@ def test_reachable_big():
     assert walkable.is_reachable(start, target)
 
 
+def test_component_of():
+
+    board = graph.Board.from_string(g_sub)
+    g = graph.Graph.from_board(board)
+    walkable = graph.make_walkable(g)
+
+    island1, island2 = graph.split_into_subgraphs(walkable)
+    label1 = walkable.component_of(island1.nodes[0])
+    label2 = walkable.component_of(island2.nodes[0])
+    assert label1 != label2
+    for node in island1.nodes:
+        assert walkable.component_of(node) == label1
+
+    # the labels follow state changes of the underlying graph
+    node = island1.nodes[0]
+    g.flood(node.x, node.y)
+    g.flood(node.x, node.y)
+    assert walkable.component_of(node) == -1
+
+
+def test_track_connectivity():
+    """
+    Test that the labels stay correct while nodes drown
+    """
+
+    random.seed(9)
+
+    g = graph.Graph.from_board(graph.Board.from_string(g_big_cluttered))
+    g.track_connectivity()
+
+    for _ in range(100):
+        g.flood(random.randrange(g.columns), random.randrange(g.rows))
+
+        walkable = graph.make_walkable(g)
+        _, components = graph.label_components(graph.Graph.from_graph(walkable))
+
+        labels = set()
+        for component in components:
+            label = g.connectivity.component_of(component.nodes[0])
+            assert label not in labels
+            labels.add(label)
+            for node in component.nodes:
+                assert g.connectivity.component_of(node) == label
+
+    for node in g.nodes:
+        if node.state == graph.State.drowned:
+            assert g.connectivity.component_of(node) == -1
+
+    # make_walkable shares the labels
+    untracked = graph.Graph.from_graph(walkable)
+    for start, target in ((0, -1), (0, 1), (10, -10)):
+        start, target = walkable.nodes[start], walkable.nodes[target]
+        assert walkable.is_reachable(start, target) == untracked.is_reachable(
+            untracked.get_node(start.x, start.y), untracked.get_node(target.x, target.y))
+
+
+def test_connectivity_relabels_split_parts_only():
+
+    g = graph.Graph.from_board(graph.Board.from_string('\n'.join(['#' * 30] * 30)))
+    g.track_connectivity()
+    label = g.connectivity.component_of(g.get_node(20, 20))
+
+    # nothing splits, so nothing is labeled again
+    g.get_node(10, 10).state = graph.State.drowned
+    assert g.connectivity.component_of(g.get_node(20, 20)) == label
+
+    # cut off the corner, only the small part gets a new label
+    for x, y in ((0, 2), (1, 2), (2, 2), (2, 1), (2, 0)):
+        g.get_node(x, y).state = graph.State.drowned
+
+    corner = g.connectivity.component_of(g.get_node(0, 0))
+    assert corner not in (label, -1)
+    assert g.connectivity.component_of(g.get_node(1, 1)) == corner
+    assert g.connectivity.component_of(g.get_node(20, 20)) == label
+    assert g.connectivity.component_of(g.get_node(3, 0)) == label
+
+
+def test_searches_reuse_tables():
+
+    g = graph.Graph.from_board(graph.Board.from_string(g_big_cluttered))
+    walkable = graph.make_walkable(g)
+
+    random.seed(11)
+    nodes = walkable.nodes
+    for _ in xrange(50):
+        start, target = random.choice(nodes), random.choice(nodes)
+        walkable.path_cache.clear()
+        expected = walkable.distances_from(start).get(target, -1)
+        walkable.path_cache.clear()
+        assert walkable.get_distance_between(start, target) == expected
+
+
 def test_get_next_node_on_path_to():
 
     board = graph.Board.from_string(g_sub)
@@ -611,6 +1052,23 @@ def test_get_distance_between():
 
 
 
+def test_distances_from():
+
+    board = graph.Board.from_string(g_big)
+    g = graph.make_walkable(graph.Graph.from_board(board))
+
+    start = g.get_node(4, 1)
+    distances = g.distances_from(start)
+
+    assert distances[start] == 0
+    for node in g.nodes:
+        assert distances.get(node, -1) == g.get_distance_between(start, node)
+
+    near = g.distances_from(start, max_depth=5)
+    assert max(near.values()) == 5
+    assert near == dict((n, d) for n, d in distances.items() if d <= 5)
+
+
 def test_get_next_node_on_path_to_3():
 
     board = graph.Board.from_string(g_sub)
@@ -625,3 +1083,159 @@ def test_get_next_node_on_path_to_3():
     assert g.get_next_node_on_path_to(start, target2) is target2
     assert g.get_next_node_on_path_to(start, unreachable) is None
 
+
+
+def test_path_cache():
+
+    board = graph.Board.from_string(g_big)
+    g = graph.make_walkable(graph.Graph.from_board(board))
+
+    start = g.get_node(4, 1)
+    target = g.get_node(20, 6)
+    distance = g.get_distance_between(start, target)
+    assert g.path_cache.misses == 1
+
+    # every node on the path can reuse the tree rooted at target
+    node = start
+    while node is not target:
+        node = g.get_next_node_on_path_to(node, target)
+        distance -= 1
+        assert g.get_distance_between(node, target) == distance
+    assert g.path_cache.misses == 1
+    assert g.path_cache.hits > 0
+
+    g.path_cache.max_size = 1
+    g.get_distance_between(start, g.get_node(10, 10))
+    g.get_distance_between(start, g.get_node(3, 3))
+    assert len(g.path_cache) == 1
+    assert g.path_cache.evictions > 0
+
+
+def test_path_cache_survives_rounds():
+
+    board = graph.Board.from_string(g_big)
+    g = graph.Graph.from_board(board)
+
+    walkable = graph.make_walkable(g)
+    start = walkable.get_node(4, 1)
+    target = walkable.get_node(20, 6)
+    distance = walkable.get_distance_between(start, target)
+
+    # a change far away from the path keeps the tree
+    g.flood(0, 0)
+    g.flood(0, 0)
+    walkable = graph.make_walkable(g)
+    assert walkable.get_distance_between(start, target) == distance
+    assert walkable.path_cache.misses == 1
+
+    # drowning a node on the path drops it
+    node = walkable.get_next_node_on_path_to(start, target)
+    g.flood(node.x, node.y)
+    g.flood(node.x, node.y)
+    walkable.get_distance_between(start, target)
+    assert walkable.path_cache.misses == 2
+
+
+def test_node_ids():
+
+    board = graph.Board.from_string(g_big)
+    g = graph.Graph.from_board(board)
+
+    for node in g.nodes:
+        assert node.id == node.y * g.columns + node.x
+
+    # equal nodes hash equal, also across graphs
+    walkable = graph.make_walkable(g)
+    node = walkable.nodes[0]
+    assert node.id == g.get_node(node.x, node.y).id
+    assert hash(node) == hash(graph.Node(node.x, node.y))
+
+    island = graph.split_into_subgraphs(walkable)[0]
+    for node in island.nodes:
+        assert node.id == island.index(node.x, node.y)
+
+
+def test_apply_and_undo():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    g = graph.Graph.from_board(board)
+    g.track_distances()
+    g.track_connectivity()
+    g.position = (4, 1)
+
+    states = [n.state for n in g.nodes]
+    fields = g.compute_distance_layers()
+    labels = [g.component_of(n) for n in g.nodes]
+    value = g.calculate_island_value()
+
+    random.seed(7)
+    for _ in xrange(50):
+        node = random.choice(g.nodes)
+        command = random.choice(['GO EAST', 'DRY CURRENT', 'FLOOD'])
+        g.apply((command, node.x, node.y))
+    g.apply(('GO NORTH', 3, 3))
+    assert g.position == (3, 3)
+
+    for _ in xrange(51):
+        g.undo()
+
+    assert g.position == (4, 1)
+    assert [n.state for n in g.nodes] == states
+    assert g.calculate_island_value() == value
+    for layer, field in fields.iteritems():
+        assert g.distance_fields[layer] == field
+
+    # drowned nodes came back, so components may have new labels
+    relabel = {}
+    for node, label in zip(g.nodes, labels):
+        assert relabel.setdefault(label, g.component_of(node)) == g.component_of(node)
+    assert len(set(relabel.values())) == len(relabel)
+
+    with pytest.raises(ValueError):
+        g.apply(('JUMP', 1, 1))
+
+
+def test_zobrist_hash():
+
+    board = graph.Board.from_string(g_big_cluttered)
+    g = graph.Graph.from_board(board)
+    g.track_hash()
+    g.position = (4, 1)
+    start = g.zobrist.value
+
+    # the same changes in another order give the same hash
+    g.apply(('DRY NORTH', 2, 2))
+    g.apply(('FLOOD', 5, 5))
+    first = g.zobrist.value
+    g.undo()
+    g.undo()
+    assert g.zobrist.value == start
+
+    g.apply(('FLOOD', 5, 5))
+    g.apply(('DRY NORTH', 2, 2))
+    assert g.zobrist.value == first
+
+    g.apply(('GO EAST', 5, 1))
+    assert g.zobrist.value != first
+    g.undo()
+    assert g.zobrist.value == first
+
+    # the hash only depends on the states and the position
+    copy = graph.Graph.from_graph(g)
+    copy.position = g.position
+    copy.track_hash()
+    assert copy.zobrist.value == g.zobrist.value
+
+
+def test_transposition_table():
+
+    table = graph.TranspositionTable(max_size=2)
+    table.put(1, 'a')
+    table.put(2, 'b')
+    assert table.get(1) == 'a'
+    table.put(3, 'c')
+
+    assert 2 not in table
+    assert table.get(2) is None
+    assert table.get(1) == 'a' and table.get(3) == 'c'
+    assert (table.hits, table.misses) == (3, 1)
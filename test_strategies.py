@@ -0,0 +1,159 @@
+import time
+
+import pytest
+
+import graph
+import strategies
+
+
+board_str = '''
+oooooooo
+o######o
+o#oooo#o
+o#o##o#o
+o#oooo#o
+o######o
+oooooooo'''.strip()
+
+
+def make_graph():
+
+    g = graph.Graph.from_board(graph.Board.from_string(board_str))
+    g.track_connectivity()
+    g.track_hash()
+    return g
+
+
+def test_no_budget_plays_drymax():
+
+    g = make_graph()
+    meta = strategies.MetaStrategy(budget=0)
+
+    actions, mode = meta.get_actions(g, (1, 1))
+
+    assert mode == 'DRYMAX'
+    assert len(actions) == 3
+    assert len(meta.overruns) == 1
+
+
+def test_late_plan_is_undone(monkeypatch):
+
+    g = make_graph()
+    states = [(n.x, n.y, n.state) for n in g.nodes]
+
+    refined = []
+    meta = strategies.MetaStrategy(budget=0.2)
+
+    def run_late(strategy_class):
+        get_actions = strategy_class.get_actions
+
+        def late(self, graph_, position):
+            actions = get_actions(self, graph_, position)
+            refined.append(actions)
+            time.sleep(0.25)
+            return actions
+        monkeypatch.setattr(strategy_class, 'get_actions', late)
+
+    run_late(strategies.MovingStrategy)
+    run_late(strategies.FarmingStrategy)
+
+    actions, mode = meta.get_actions(g, (1, 1))
+
+    # the refined plan dried fields but came too late
+    assert any(action.startswith('DRY') for action, _, _ in refined[0])
+    assert mode == 'DRYMAX'
+    assert [(n.x, n.y, n.state) for n in g.nodes] == states
+
+
+def test_farming_moves_towards_flooded_fields():
+
+    board = graph.Board.from_string('######\n######\n#####o')
+    g = graph.Graph.from_board(board)
+    meta = strategies.MetaStrategy(budget=5)
+
+    actions, mode = meta.get_actions(g, (0, 0))
+
+    assert mode == 'FARMING'
+    assert [action for action, _, _ in actions] == ['GO EAST', 'GO EAST', 'GO EAST']
+    assert not meta.overruns
+
+
+def test_replay_plans():
+
+    far_board = '######\n######\n#####o'
+
+    for strategy_class, s, position in ((strategies.DryMaxStrategy, far_board, (0, 0)),
+                                        (strategies.DryMaxStrategy, board_str, (1, 1)),
+                                        (strategies.MetaStrategy, board_str, (3, 3))):
+        g = graph.Graph.from_board(graph.Board.from_string(s))
+        g.track_hash()
+        g.position = position
+        hash_, states = g.zobrist.value, [n.state for n in g.nodes]
+
+        # plan on a copy, so the replay starts from the original states
+        planned = graph.Graph.from_graph(g)
+        strategy = strategy_class()
+        strategy.extended_islands = []
+        actions = strategy.get_actions(graph.make_walkable(planned), position)
+        if isinstance(actions, tuple):
+            actions = actions[0]
+
+        for action in actions:
+            g.apply(action)
+        moves = [(x, y) for action, x, y in actions if action.startswith('GO')]
+        if moves:
+            assert g.position == moves[-1]
+        for action, x, y in actions:
+            if action.startswith('DRY'):
+                assert g.get_node(x, y).state == graph.State.redry
+
+        for _ in actions:
+            g.undo()
+        assert g.position == position
+        assert g.zobrist.value == hash_
+        assert [n.state for n in g.nodes] == states
+
+
+def test_failed_plan_is_undone(monkeypatch):
+
+    g = make_graph()
+    states = [n.state for n in g.nodes]
+
+    dry_one_if_possible = strategies.Strategy.dry_one_if_possible
+
+    def dry_once(self, graph_):
+        if self.actions:
+            raise RuntimeError('planning failed')
+        return dry_one_if_possible(self, graph_)
+
+    monkeypatch.setattr(strategies.MovingStrategy, 'dry_one_if_possible', dry_once)
+    monkeypatch.setattr(strategies.FarmingStrategy, 'dry_one_if_possible', dry_once)
+
+    meta = strategies.MetaStrategy()
+    with pytest.raises(RuntimeError):
+        meta.ponder(g, (1, 1))
+
+    assert [n.state for n in g.nodes] == states
+    assert len(meta.transpositions) == 0
+
+
+def test_apply_moves_in_direction():
+
+    g = graph.Graph.from_board(graph.Board.from_string(board_str))
+    g.position = (1, 1)
+
+    g.apply(('GO EAST', None, None))
+    g.apply(('GO SOUTH', None, None))
+    g.apply(('GO CURRENT', None, None))
+    assert g.position == (2, 2)
+
+    g.apply(('DRY CURRENT', None, None))
+    assert g.get_node(2, 2).state == graph.State.redry
+
+    with pytest.raises(ValueError):
+        g.apply(('GO', None, None))
+
+    for _ in range(4):
+        g.undo()
+    assert g.position == (1, 1)
+    assert g.get_node(2, 2).state == graph.State.flooded
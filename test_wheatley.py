@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+
+from graph import make_walkable
+from wheatley import LineReader, Ponderer, Wheatley
+
+
+def test_line_reader():
+
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, 'ROUND 1 2,3\nFLOOD 1,1\n\nFLOOD 2,')
+    os.write(write_fd, '2\nEND')
+    os.close(write_fd)
+
+    lines = list(LineReader(read_fd, chunk_size=4))
+    os.close(read_fd)
+
+    assert lines == ['ROUND 1 2,3', 'FLOOD 1,1', '', 'FLOOD 2,2', 'END']
+
+
+def test_ponderer_stop():
+
+    started = threading.Event()
+    done = []
+
+    def task(stopped):
+        started.set()
+        while not stopped.is_set():
+            time.sleep(0.001)
+        done.append(1)
+
+    ponderer = Ponderer()
+    ponderer.start(task)
+    started.wait()
+
+    # stop tells the task to return and waits for it
+    ponderer.stop()
+    assert done == [1]
+
+    ponderer.stop()
+    assert done == [1]
+
+
+def test_planned_ahead_round_is_looked_up():
+
+    bot = Wheatley()
+    sent = []
+    bot.send = sent.append
+
+    for line in ('oooooo', 'o####o', 'o#oo#o', 'o####o', 'oooooo', 'GAMEBOARDEND'):
+        bot.dispatch(line)
+    bot.dispatch('ROUND 1 2,2')
+
+    x, y = 1, 1
+    moves = {'NORTH': (0, -1), 'EAST': (1, 0), 'SOUTH': (0, 1), 'WEST': (-1, 0)}
+    for cmd in sent:
+        command, direction = cmd.split()
+        if command == 'GO' and direction in moves:
+            x, y = x + moves[direction][0], y + moves[direction][1]
+
+    # nothing floods at flood level 0, so the next round is known
+    planned = len(bot.strategy.transpositions)
+    bot.plan_ahead((x, y), threading.Event())
+    assert len(bot.strategy.transpositions) == planned + 1
+
+    bot.dispatch('ROUND 2 {},{}'.format(x + 1, y + 1))
+    assert bot.strategy.transpositions.hits == 1
+
+
+def test_flooded_distances_are_tracked():
+
+    bot = Wheatley()
+    for line in ('######', '######', '#####o', 'GAMEBOARDEND'):
+        bot.dispatch(line)
+
+    walkable = make_walkable(bot.graph)
+    assert walkable.get_node(0, 0).distance_to_flooded == 6
+
+    bot.dispatch('FLOOD 2,2')
+    assert walkable.get_node(0, 0).distance_to_flooded == 1
+
+
+def test_likely_floods_are_planned_for():
+
+    bot = Wheatley()
+    sent = []
+    bot.send = sent.append
+
+    bot.dispatch('INCRFLOOD 1')
+    for line in ('oooooo', 'o####o', 'o#oo#o', 'o####o', 'oooooo', 'GAMEBOARDEND'):
+        bot.dispatch(line)
+    bot.dispatch('ROUND 1 2,2')
+
+    x, y = 1, 1
+    moves = {'NORTH': (0, -1), 'EAST': (1, 0), 'SOUTH': (0, 1), 'WEST': (-1, 0)}
+    for cmd in sent:
+        command, direction = cmd.split()
+        if command == 'GO' and direction in moves:
+            x, y = x + moves[direction][0], y + moves[direction][1]
+
+    # any one field may flood, each of them is planned for
+    planned = len(bot.strategy.transpositions)
+    bot.plan_ahead((x, y), threading.Event())
+    assert len(bot.strategy.transpositions) > planned + 1
+
+    bot.dispatch('FLOOD 6,5')
+    bot.dispatch('ROUND 2 {},{}'.format(x + 1, y + 1))
+    assert bot.strategy.transpositions.hits == 1
@@ -11,17 +11,89 @@ communicate with the server via stdin and stdout
 :license: BSD, see LICENSE for more details.
 """
 
+import os
 import sys
+import threading
 
-from graph import Board, Graph
+from floodcards import FloodCards
+from graph import Board, Graph, State, make_walkable
 from strategies import MetaStrategy
 
 
-class Wheatley(object):
+# how many of the possible sets of floods are planned for ahead of a round
+PONDER_FLOOD_SETS = 100
+
+
+class LineReader(object):
+    """
+    Reads lines from a file descriptor. The input is read in big chunks and
+    split into lines in a buffer, so a whole round needs only a few reads.
+    Iteration stops at the end of the input.
+    """
+
+    def __init__(self, fd, chunk_size=65536):
+
+        self.fd = fd
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+
+        buffered = ''
+        while True:
+            chunk = os.read(self.fd, self.chunk_size)
+            if not chunk:
+                break
+
+            lines = (buffered + chunk).split('\n')
+            buffered = lines.pop()
+            for line in lines:
+                yield line
+
+        if buffered:
+            yield buffered
+
+
+class Ponderer(object):
+    """
+    Runs a task in a background thread while the bot waits for the server.
+    The task is called with a threading.Event which stop sets, it has to
+    return soon after that. stop returns once it has, so the task may use
+    the graph as long as it is not touched before stop.
+    """
 
     def __init__(self):
 
+        self._thread = None
+        self._stopped = None
+
+    def start(self, task):
+
+        self.stop()
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=task, args=(self._stopped,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+
+
+class Wheatley(object):
+    """
+    If ponder is set, the work for the next round is started in the
+    background as soon as the actions of a round are sent.
+    """
+
+    def __init__(self, ponder=False):
+
         self.board = None
+        self.graph = None
+        self.flood_cards = None
 
         self.strategy = MetaStrategy()
 
@@ -31,63 +103,133 @@ class Wheatley(object):
 
         self.board_str = ''
 
+        # commands which are sent with the next flush
+        self.output = []
+
+        self.ponder = ponder
+        self.ponderer = Ponderer()
+
 
     def dispatch(self, line):
 
+        # the graph belongs to this thread again
+        self.ponderer.stop()
+
         if line[0] in ('#', 'o', '.'):
             self.board_str += line + '\n'
         elif line.startswith('GAMEBOARDEND'):
             self.board = Board.from_string(self.board_str)
+            self.graph = Graph.from_board(self.board)
+            # the strategies read the distances to flooded fields through
+            # the walkable view
+            make_walkable(self.graph).track_distances(('flooded',))
+            self.graph.track_connectivity()
+            self.graph.track_hash()
+            self.flood_cards = FloodCards(self.board, self.floodlevel)
+            self.strategy.flood_cards = self.flood_cards
         elif line.startswith('ROUND'):
 
             self.current_round = int(line.split()[1])
             self.strategy.round_ = self.current_round
+            self.strategy.floodlevel = self.floodlevel
 
             x, y = map(int, line.split()[2].split(','))
             self.position = (x-1, y-1)
 
-            graph = Graph.from_board(self.board)
-            actions, mode = self.strategy.get_actions(graph, self.position)
+            actions, mode = self.strategy.get_actions(self.graph, self.position)
             for (action, x, y) in actions:
                 self.send(action)
 
                 if action.startswith('DRY'):
                     self.board.dry(x, y)
+                    self.graph.dry(x, y)
+            self.flush()
+
+            if self.ponder:
+                position = self.position
+                for action, x, y in actions:
+                    if action.startswith('GO') and x is not None:
+                        position = (x, y)
+
+                self.ponderer.start(lambda stopped: self.plan_ahead(position, stopped))
         elif line.startswith('FLOOD'):
             x, y = map(int, line.split()[1].split(','))
             self.board.flood(x-1, y-1)
+            self.graph.flood(x-1, y-1)
+            drowned = self.board.get_state(x-1, y-1) == State.drowned
+            self.flood_cards.card_drawn(x-1, y-1, drowned)
+        elif line.startswith('INCRFLOOD'):
+            n = int(line.split()[1])
+            self.floodlevel += n
+            if self.flood_cards is not None:
+                self.flood_cards.increase_level(n)
         elif line.startswith('END'):
             return True
 
         return False
 
 
+    def plan_ahead(self, position, stopped):
+        """
+        Plan the next round for the bot at position, for the sets of fields
+        which are likeliest to flood before it. If the flood cards tell which
+        fields flood that is just one set. Planning stops early once the
+        event stopped is set.
+        """
+
+        for count, fields in enumerate(self.flood_cards.likely_floods()):
+            if count == PONDER_FLOOD_SETS or stopped.is_set():
+                return
+
+            for x, y in fields:
+                self.graph.apply(('FLOOD', x, y))
+            try:
+                self.strategy.ponder(self.graph, position, stopped)
+            finally:
+                for _ in fields:
+                    self.graph.undo()
+
+
     def send(self, cmd):
         """
-        Send commando cmd back to the server
+        Send commando cmd back to the server with the next flush
+        """
+        self.output.append(cmd + '\n')
+
+
+    def flush(self):
+        """
+        Write all commands sent since the last flush at once
         """
-        sys.stdout.write(cmd + '\n')
+
+        if not self.output:
+            return
+
+        sys.stdout.write(''.join(self.output))
+        self.output = []
 
         try:
             sys.stdout.flush()
-            sys.stderr.flush()
         except IOError:
             pass
 
 
     def run(self):
 
-        while True:
-            line = sys.stdin.readline().strip()
+        for line in LineReader(sys.stdin.fileno()):
+            line = line.strip()
             if line:
                 should_exit = self.dispatch(line)
                 if should_exit:
                     break
 
+        self.ponderer.stop()
+        self.flush()
+
 
 if __name__ == '__main__':
 
-    wheatley = Wheatley()
+    wheatley = Wheatley(ponder=True)
     wheatley.run()
 
 